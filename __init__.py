@@ -1,7 +1,7 @@
 from rbm import *
 from vmc import *
 from sr import *
-from cgen import RBMConfigGenerator
+from cgen import RBMConfigGenerator,BatchRBMConfigGenerator
 from sstate import *
 
 __all__=['linop','group','toymodel','utils']
@@ -5,7 +5,7 @@ Binning staticstics.
 from numpy import *
 import pdb
 
-__all__=['Bin']
+__all__=['Bin','StreamBin','SampleBin']
 
 class Bin(object):
     '''
@@ -35,22 +35,51 @@ class Bin(object):
         '''
         Show statistics.
         '''
-        print '> Binning statistics: \n  Autocorrelation Time: %.4f\n  Standard Error: %.4f'%(nan if self.nbin<2 else abs(self.t_auto()),nan if self.nbin<2 else abs(mean(sqrt(self.std_err()))))
+        print '> Binning statistics: \n  Autocorrelation Time: %.4f\n  Standard Error: %.4f'%(nan if self.nbin<2 else abs(self.t_auto()),nan if self.nbin<2 else abs(mean(self.std_err())))
 
-    def push(self,vals):
+    def push(self,vals,weights=None):
         '''
         Push datas to bin.
+
+        Parameters:
+            :vals: array, samples in the first axis.
+            :weights: 1darray/None, weights of samples, the block is then counted as sum(weights) samples, e.g. importance weights
+                scaled to sum up to the effective sample size.
         '''
         vals=asarray(vals)
-        o_mean=vals.mean(axis=0)
-        o_sq_mean=(vals**2).mean(axis=0)
-        self.n.append(len(vals))
+        #accumulate in double precision.
+        vals=vals.astype(result_type(vals.dtype,'float64'))
+        if weights is None:
+            o_mean=vals.mean(axis=0)
+            o_sq_mean=(vals**2).mean(axis=0)
+            n=len(vals)
+        else:
+            n=sum(weights)
+            p=reshape(weights,[-1]+[1]*(vals.ndim-1))/n
+            o_mean=(p*vals).sum(axis=0)
+            o_sq_mean=(p*vals**2).sum(axis=0)
+        self.n.append(n)
         self.m.append(o_mean)
         self.sqm.append(o_sq_mean)
 
+    def merge(self,other):
+        '''
+        Merge blocks of another Bin, e.g. one from an independent chain.
+
+        Parameters:
+            :other: <Bin>,
+
+        Return:
+            <Bin>, self.
+        '''
+        self.n.extend(other.n)
+        self.m.extend(other.m)
+        self.sqm.extend(other.sqm)
+        return self
+
     def std_err(self):
-        '''Standard Error of result.'''
-        return sqrt(self.var()/sum(self.n))
+        '''Standard Error of result, estimated from the variance of block means.'''
+        return sqrt(self.var()/self.nbin)
 
     def var(self):
         '''Binned Variance.'''
@@ -74,3 +103,290 @@ class Bin(object):
         '''
         n=reshape(self.n,[-1]+[1]*ndim(self.m[0]))
         return sum(n*self.m,axis=0)/n.sum()
+
+class StreamBin(object):
+    '''
+    Streaming binning statistics in constant memory.
+
+    Level k keeps Welford running sums (count, mean, sum of squared deviations) of the averages of 2^k successive samples,
+    samples not yet paired are kept as pending values, so the memory is O(nlevel*size) regardless of the number of samples.
+
+    Attributes:
+        :nlevel: int, depth of the log-binning hierarchy.
+        :nmin: int, the minimum number of entries of a level to be used in default error analysis.
+        :counts: list, number of entries of each level.
+        :means: list, running mean of each level.
+        :m2s: list, running sum of squared deviations of each level.
+    '''
+    def __init__(self,nlevel=16,nmin=32):
+        self.nlevel=nlevel
+        self.nmin=nmin
+        self.counts=[0]*nlevel
+        self.means=[0]*nlevel
+        self.m2s=[0]*nlevel
+        self._pending=[None]*nlevel
+
+    def __str__(self):
+        return 'StreamBin(%s)'%self.counts[0]
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def nbin(self):
+        '''Number of entries of the level used in default error analysis.'''
+        return self.counts[self.get_level()]
+
+    def get_level(self):
+        '''The highest level with at least nmin entries, or 0.'''
+        levels=[k for k in xrange(self.nlevel) if self.counts[k]>=self.nmin]
+        return levels[-1] if len(levels)>0 else 0
+
+    def print_stat(self):
+        '''
+        Show statistics.
+        '''
+        print '> Binning statistics: \n  Autocorrelation Time: %.4f\n  Standard Error: %.4f'%(nan if self.nbin<2 else abs(mean(self.t_auto())),nan if self.nbin<2 else abs(mean(self.std_err())))
+
+    def _add_stat(self,k,n,m,m2):
+        '''Merge (count, mean, sum of squared deviations) into level k.'''
+        na=self.counts[k]
+        if na==0:
+            self.counts[k],self.means[k],self.m2s[k]=n,m,m2
+            return
+        delta=m-self.means[k]
+        self.counts[k]=na+n
+        self.means[k]=self.means[k]+delta*(1.*n/(na+n))
+        self.m2s[k]=self.m2s[k]+m2+abs(delta)**2*(1.*na*n/(na+n))
+
+    def _feed(self,k,vals):
+        '''Feed entries to level k, and pair them up to higher levels.'''
+        if k>=self.nlevel or len(vals)==0: return
+        m=vals.mean(axis=0)
+        self._add_stat(k,len(vals),m,(abs(vals-m)**2).sum(axis=0))
+        if self._pending[k] is not None:
+            vals=concatenate([self._pending[k][newaxis],vals],axis=0)
+        if len(vals)%2==1:
+            self._pending[k],vals=vals[-1],vals[:-1]
+        else:
+            self._pending[k]=None
+        self._feed(k+1,(vals[0::2]+vals[1::2])/2.)
+
+    def push(self,vals,weights=None):
+        '''
+        Push datas to bin, weighted samples are not supported.
+        '''
+        if weights is not None: raise TypeError('StreamBin does not support weights.')
+        vals=asarray(vals)
+        #accumulate in double precision.
+        vals=vals.astype(result_type(vals.dtype,'float64'))
+        self._feed(0,vals)
+
+    def merge(self,other):
+        '''
+        Merge statistics of another StreamBin, e.g. one from an independent chain.
+
+        Parameters:
+            :other: <StreamBin>,
+
+        Return:
+            <StreamBin>, self.
+        '''
+        for k in xrange(self.nlevel):
+            if other.counts[k]>0:
+                self._add_stat(k,other.counts[k],other.means[k],other.m2s[k])
+        #pair the pending values of two chains, they are already counted in their levels.
+        for k in xrange(self.nlevel):
+            p=other._pending[k]
+            if p is None: continue
+            if self._pending[k] is None:
+                self._pending[k]=p
+            else:
+                pair=(self._pending[k]+p)/2.
+                self._pending[k]=None
+                self._feed(k+1,pair[newaxis])
+        return self
+
+    def var(self,level=None):
+        '''Variance of entries of a level, default is `get_level()`.'''
+        k=self.get_level() if level is None else level
+        n=self.counts[k]
+        return nan if n<2 else self.m2s[k]/(n-1.)
+
+    def var_unbinned(self):
+        '''Unbinned variance.'''
+        return self.var(0)
+
+    def std_err(self,level=None):
+        '''Standard Error of result, estimated from the entries of a level, default is `get_level()`.'''
+        k=self.get_level() if level is None else level
+        return sqrt(self.var(k)/self.counts[k]) if self.counts[k]>1 else nan
+
+    def t_auto(self,level=None):
+        '''Autocorrelation time estimated at a level, default is `get_level()`.'''
+        k=self.get_level() if level is None else level
+        return 0.5*2**k*mean(self.var(k))/mean(self.var(0))
+
+    def mean(self):
+        '''
+        Mean value of observable.
+        '''
+        return self.means[0]
+
+class SampleBin(object):
+    '''
+    Statistics of a vector observable that keeps its covariance matrix, or all of its samples.
+
+    Samples are copied into a preallocated buffer of `nsample_block` rows, a full buffer is centred and reduced to
+    the covariance with one GEMM, blocks are combined with Chan's formula.
+
+    Attributes:
+        :nsample_block: int, number of rows in the buffer.
+        :keep_samples: bool, keep all samples (as the sample matrix of matrix-free solvers) instead of the covariance.
+        :count: number, number of samples, weighted samples are counted by their weights.
+        :samples: list, blocks of kept samples.
+        :weights: list, weights of kept samples, one array for each block.
+    '''
+    def __init__(self,nsample_block=1000,keep_samples=False):
+        self.nsample_block=nsample_block
+        self.keep_samples=keep_samples
+        self.count=0
+        self.samples=[]
+        self.weights=[]
+        self._mean=0
+        self._cov=0     #sum of centred outer products.
+        self._buf=None
+        self._nfill=0
+
+    def __str__(self):
+        return 'SampleBin(%s)'%(self.count+self._nfill)
+
+    def __repr__(self):
+        return self.__str__()
+
+    @property
+    def nbin(self):
+        return self.count+self._nfill
+
+    def print_stat(self):
+        '''
+        Show statistics.
+        '''
+        print '> Sample statistics: \n  Number of Samples: %s\n  Standard Error: %.4f'%(self.nbin,nan if self.nbin<2 else abs(mean(self.std_err())))
+
+    def push(self,vals,weights=None):
+        '''
+        Push datas to bin.
+
+        Parameters:
+            :vals: 2darray, samples of shape (nsample, size).
+            :weights: 1darray/None, weights of samples, they are counted as sum(weights) samples, see <Bin>.push.
+        '''
+        vals=asarray(vals)
+        if weights is not None:
+            self._flush()
+            n=sum(weights)
+            p=asarray(weights)/n
+            m=p.dot(vals)
+            if self.keep_samples:
+                self.samples.append(array(vals,dtype=result_type(vals.dtype,'float64')))
+                self.weights.append(asarray(weights,dtype='float64'))
+                self._add_stat(n,m,0)
+            else:
+                Xc=vals-m
+                self._add_stat(n,m,n*(Xc.T.conj()*p).dot(Xc))
+            return
+        if self._buf is None:
+            self._buf=empty((self.nsample_block,)+vals.shape[1:],dtype=result_type(vals.dtype,'float64'))
+        i=0
+        while i<len(vals):
+            n=min(len(vals)-i,self.nsample_block-self._nfill)
+            self._buf[self._nfill:self._nfill+n]=vals[i:i+n]
+            self._nfill+=n; i+=n
+            if self._nfill==self.nsample_block: self._flush()
+
+    def _flush(self):
+        '''Reduce the samples in buffer.'''
+        n=self._nfill
+        if n==0: return
+        X=self._buf[:n]
+        m=X.mean(axis=0)
+        if self.keep_samples:
+            self.samples.append(X.copy())
+            self.weights.append(ones(n))
+            self._add_stat(n,m,0)
+        else:
+            Xc=X-m
+            self._add_stat(n,m,Xc.T.conj().dot(Xc))
+        self._nfill=0
+
+    def _add_stat(self,n,m,cov):
+        '''Merge (count, mean, sum of centred outer products).'''
+        na=self.count
+        delta=m-self._mean
+        self.count=na+n
+        self._mean=self._mean+delta*(1.*n/(na+n))
+        if not self.keep_samples:
+            self._cov=self._cov+cov+delta.conj()[:,newaxis]*delta*(1.*na*n/(na+n))
+
+    def merge(self,other):
+        '''
+        Merge statistics of another SampleBin, e.g. one from an independent chain.
+
+        Parameters:
+            :other: <SampleBin>,
+
+        Return:
+            <SampleBin>, self.
+        '''
+        self._flush(); other._flush()
+        if other.count>0:
+            self._add_stat(other.count,other._mean,other._cov)
+            self.samples.extend(other.samples)
+            self.weights.extend(other.weights)
+        return self
+
+    def mean(self):
+        '''
+        Mean value of observable.
+        '''
+        self._flush()
+        return self._mean
+
+    def cov(self):
+        '''Covariance matrix <x^*x^T>-<x^*><x^T>, normalized by the number of samples.'''
+        self._flush()
+        if self.keep_samples:
+            Xc=self.get_samples(centred=True)
+            return Xc.T.conj().dot(Xc)/len(Xc)
+        return self._cov/self.count
+
+    def get_samples(self,centred=False):
+        '''
+        Get the sample matrix, rows of weighted samples are scaled by sqrt(weight*nrow/count), so that X^H X/nrow is the weighted sum.
+
+        Parameters:
+            :centred: bool, subtract the mean.
+
+        Return:
+            2darray, samples of shape (nsample, size).
+        '''
+        if not self.keep_samples: raise ValueError('samples are not kept.')
+        self._flush()
+        X=concatenate(self.samples,axis=0)
+        if centred: X=X-self._mean
+        w=concatenate(self.weights)
+        if any(w!=1): X=X*sqrt(w*len(w)/w.sum())[:,newaxis]
+        return X
+
+    def var(self):
+        '''Variance of samples.'''
+        self._flush()
+        if self.keep_samples:
+            Xc=self.get_samples(centred=True)
+            return (abs(Xc)**2).sum(axis=0)/(len(Xc)-1.)
+        return self._cov.diagonal().real/(self.count-1.)
+
+    def std_err(self):
+        '''Standard Error of result, samples are regarded as independent.'''
+        return sqrt(self.var()/self.nbin)
@@ -3,13 +3,108 @@
 from numpy import *
 from scipy.linalg import norm
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 import pdb,time
 
 from utils import logfh
 from clib.cutils import pop1D,pop2D,pop_nogroup
-from clib.futils import fpop_nogroup
+from clib import futils
+from group import TIGroup
 
-__all__=['RBMConfigGenerator','ConfigGenerator']
+__all__=['RBMConfigGenerator','BatchRBMConfigGenerator','ConfigGenerator','pad_flips','pack_configs']
+
+def is_real_state(state):
+    '''Decide whether the parameters of a state are real, which enables real kernels.'''
+    return not any([iscomplexobj(x) for x in [state.a,state.b,state.W]])
+
+#suffixes of compiled kernels and the dtypes of their theta tables.
+KERNEL_DTYPES={'':'complex128','d':'float64','c':'complex64','s':'float32'}
+
+def get_kernel_suffix(state,precision='double'):
+    '''
+    Get the suffix of compiled kernels for a state.
+
+    Parameters:
+        :state: <RBM>,
+        :precision: 'double'/'single', the precision of sampling.
+
+    Return:
+        str, one of the keys of KERNEL_DTYPES.
+    '''
+    real=is_real_state(state)
+    if precision=='double':
+        return 'd' if real else ''
+    elif precision=='single':
+        return 's' if real else 'c'
+    else:
+        raise ValueError('unsupported precision %s'%precision)
+
+def get_folded_WT(state):
+    '''
+    Get the transposed weight for compiled kernels, W is kept folded for 1D and 2D translation groups.
+
+    Parameters:
+        :state: <RBM>,
+
+    Return:
+        tuple, (WT in fortran order, ngs of length 2).
+    '''
+    group=state.group
+    if isinstance(group,TIGroup) and len(group.ngs)<=2:
+        ngs=ones(2,dtype='int32')
+        ngs[2-len(group.ngs):]=group.ngs
+        return asfortranarray(state.W.T),ngs
+    else:
+        return asfortranarray(state.get_W_nogroup().T),ones(2,dtype='int32')
+
+def pad_flips(flips_list):
+    '''
+    Pack flip patterns into an int32 array of shape (nconfig, nfmax), padded with -1.
+
+    Parameters:
+        :flips_list: list of 1darray/2darray, positions to flip for each config.
+
+    Return:
+        2darray,
+    '''
+    if isinstance(flips_list,ndarray) and flips_list.ndim==2:
+        flips=flips_list
+    else:
+        nfmax=max([len(f) for f in flips_list]+[1])
+        flips=-ones([len(flips_list),nfmax],dtype='int32')
+        for k,f in enumerate(flips_list):
+            flips[k,:len(f)]=f
+    if flips.shape[1]==0:
+        flips=-ones([len(flips),1],dtype='int32')
+    return asarray(flips,dtype='int32')
+
+def pack_configs(configs,table=None):
+    '''
+    Pack spin configs into uint64 words, translation equivalent configs are canonicalised to the same words.
+
+    Parameters:
+        :configs: 2darray, configs of {1,-1} with shape (nconfig, nin).
+        :table: 2darray/None, site table of translations with shape (ng, nin), e.g. `TIGroup.apply_all(arange(nin))`,
+            configs are canonicalised by the minimum words over translations.
+
+    Return:
+        2darray, uint64 words of shape (nconfig, nword).
+    '''
+    configs=asarray(configs)
+    nconfig,nin=configs.shape
+    nbyte=8*((nin+63)/64)
+    if table is not None:
+        configs=configs[:,table].swapaxes(0,1)  #(ng, nconfig, nin)
+    else:
+        configs=configs[newaxis]
+    bits=packbits(configs<0,axis=-1)
+    words=zeros(bits.shape[:-1]+(nbyte,),dtype='uint8')
+    words[...,:bits.shape[-1]]=bits
+    words=words.view('>u8')
+    if len(words)==1: return words[0]
+    #lexical minimum over translations, the first word is the primary key.
+    order=lexsort(words[...,::-1].transpose([2,0,1]),axis=0)[0]
+    return words[order,arange(nconfig)]
 
 class ConfigGenerator(object):
     '''
@@ -72,15 +167,40 @@ class RBMConfigGenerator(ConfigGenerator):
     Attributes:
         :state: <RBM>,
         :runtime: dict, runtime variables.
+        :precision: 'double'/'single', in single precision, W, a and theta used in sampling are stored in complex64/float32.
+        :nresync: int, re-synchronise theta from scratch after this number of accepted moves in single precision.
+        :diag_op: <LinOp>/None, an operator providing `get_diag_bonds`, its diagonal (Sz*Sz) energy is tracked in `ediag`.
+        :ediag: number, the diagonal energy of diag_op on current config.
+        :cache_size: int, the maximum number of log amplitudes kept in the LRU cache used by pop_many, 0 to disable it.
+            Lookups are done in Python, so it only pays off when amplitudes are expensive (many hidden units or flips).
+        :cache_hits,cache_misses: int, the statistics of cache.
     '''
     counter=0
-    def __init__(self,nflip,initial_config=None):
+    def __init__(self,nflip,initial_config=None,precision='double',nresync=1000,diag_op=None,cache_size=0):
         self.nflip=nflip
+        self.precision=precision
+        self.nresync=nresync
+        self.diag_op=diag_op
+        self.ediag=None
+        self.cache_size=cache_size
+        self.cache_hits=self.cache_misses=0
+        self._cache=OrderedDict()   #packed config -> log amplitude.
+        self._cache_table=None      #site table of translations used to canonicalise cache keys.
         self.state=None
         self.theta=None       #\sigma*W+b
-        self._WT_nogroup=None  #no group version of W
+        self.lnfh=None        #log(fh(theta)), cached to skip the old side in pop.
+        self._WT=None         #transposed W, folded if the group is supported by compiled kernels.
+        self._ngs=None        #2D translation group of _WT, (1,1) if _WT is unfolded.
+        self._suffix=''       #suffix of compiled kernels.
+        self._nupdate=0       #number of accepted moves since last synchronization.
+        self._ups=None        #indices of up spins (first _nup entries), used in pair exchange proposals.
+        self._downs=None      #indices of down spins (first _ndown entries).
+        self._pos=None        #position of a site in _ups or _downs.
+        self._nup=self._ndown=0
         self._a_nogroup=None  #no group version a
         self._theta=None      #the update candidate of theta
+        self._lnfh=None       #the update candidate of lnfh
+        self._adj=None        #adjacency table (ptr,sites,couplings) of diag_op.
         if hasattr(initial_config,'__iter__'):
             initial_config=asarray(initial_config)
         self.config=initial_config
@@ -89,16 +209,134 @@ class RBMConfigGenerator(ConfigGenerator):
         self.state=state
         if self.config is None:
             self.config=self.random_config()
-        self.theta=state.feed_input(self.config)   # bug fix note: remember these two lines are needed!
-        self._WT_nogroup=asfortranarray(state.get_W_nogroup().T)
-        self._a_nogroup=state.get_a_nogroup()
-        self._theta=None
+        self.config=asarray(self.config,dtype='int32')
+        self._suffix=get_kernel_suffix(state,self.precision)
+        dtype=KERNEL_DTYPES[self._suffix]
+        self.theta=asarray(state.feed_input(self.config),dtype=dtype)   # bug fix note: remember these two lines are needed!
+        self.lnfh=self._kernel('flogfh_table')(self.theta,fh_id=0)
+        self._WT,self._ngs=get_folded_WT(state)
+        self._WT=asfortranarray(self._WT,dtype=dtype)
+        self._a_nogroup=asarray(state.get_a_nogroup(),dtype=dtype)
+        self._nupdate=0
+        #preallocated candidate buffers, swapped with the current ones on confirm.
+        self._theta=empty_like(self.theta)
+        self._lnfh=empty_like(self.lnfh)
+        self._build_site_lists()
+        if self.diag_op is not None: self._build_diag()
+        #amplitudes of old parameters are invalid.
+        self._cache.clear()
+        self._cache_table=state.group.apply_all(arange(state.nin)) if isinstance(state.group,TIGroup) else None
 
     def random_config(self):
         rbm=self.state
         config=1-2*random.randint(0,2,rbm.nin)
         return config
 
+    def load_config(self,config,theta=None):
+        '''
+        Jump to a new config of the same state, only config, theta and lnfh (and the tables derived from config) are updated.
+
+        Parameters:
+            :config: 1darray, the new config.
+            :theta: 1darray/None, hidden layer output of the new config, computed if None.
+        '''
+        self.config=asarray(config,dtype='int32').copy()
+        self.theta=asarray(self.state.feed_input(self.config) if theta is None else theta,dtype=self.theta.dtype)
+        self.lnfh=self._kernel('flogfh_table')(self.theta,fh_id=0)
+        self._theta=empty_like(self.theta)
+        self._lnfh=empty_like(self.lnfh)
+        self._nupdate=0
+        if self._ups is not None: self._build_site_lists()
+        if self._adj is not None: self.reset_ediag()
+
+    def _kernel(self,name):
+        '''Get the compiled kernel matching the dtype of state and precision.'''
+        return getattr(futils,name+self._suffix)
+
+    def resync(self):
+        '''Re-synchronise theta and lnfh from scratch, bounding the drift of single precision updates.'''
+        self.theta[...]=self.state.feed_input(self.config)
+        self.lnfh[...]=self._kernel('flogfh_table')(self.theta,fh_id=0)
+        self._nupdate=0
+        if self._adj is not None: self.reset_ediag()
+
+    def get_lnpsi(self):
+        '''Log amplitude of current config, up to a constant.'''
+        return self._a_nogroup.dot(self.config)+self.lnfh.sum()
+
+    def _build_site_lists(self):
+        '''Build index lists of up and down spins.'''
+        nsite=len(self.config)
+        upmask=self.config==1
+        ups,downs=where(upmask)[0],where(~upmask)[0]
+        self._nup,self._ndown=len(ups),len(downs)
+        self._ups,self._downs=zeros(nsite,dtype='int64'),zeros(nsite,dtype='int64')
+        self._ups[:self._nup]=ups
+        self._downs[:self._ndown]=downs
+        self._pos=zeros(nsite,dtype='int64')
+        self._pos[ups]=arange(self._nup)
+        self._pos[downs]=arange(self._ndown)
+
+    def _build_diag(self):
+        '''Build the adjacency table of diag_op and the diagonal energy.'''
+        bonds,Jz=self.diag_op.get_diag_bonds()
+        nsite=len(self.config)
+        bi=concatenate([bonds[:,0],bonds[:,1]])
+        bj=concatenate([bonds[:,1],bonds[:,0]])
+        order=argsort(bi,kind='mergesort')
+        self._adj=(searchsorted(bi[order],arange(nsite+1)),bj[order],concatenate([Jz,Jz])[order]/4.)
+        self._diag_bonds=(bonds[:,0],bonds[:,1],Jz/4.)
+        self.reset_ediag()
+
+    def reset_ediag(self):
+        '''Recompute the diagonal energy from scratch.'''
+        bi,bj,Jz=self._diag_bonds
+        self.ediag=(Jz*self.config[bi]*self.config[bj]).sum()
+
+    def _flip_ediag(self,flips):
+        '''Update the diagonal energy before flipping sites, O(degree) per site.'''
+        ptr,sites,Jz=self._adj
+        c=self.config
+        if len(flips)==1:
+            f=flips[0]
+            self.ediag-=2*c[f]*Jz[ptr[f]:ptr[f+1]].dot(c[sites[ptr[f]:ptr[f+1]]])
+            return
+        cflip=c[flips]
+        #bonds between two flipped sites are unchanged, exclude them by zeroing flipped sites temporarily.
+        c[flips]=0
+        for f,cf in zip(flips,cflip):
+            self.ediag-=2*cf*Jz[ptr[f]:ptr[f+1]].dot(c[sites[ptr[f]:ptr[f+1]]])
+        c[flips]=cflip
+
+    def _flip_site_lists(self,flips):
+        '''Patch index lists of up and down spins before flipping sites, O(1) per site.'''
+        ups,downs,pos=self._ups,self._downs,self._pos
+        if len(flips)==2 and self.config[flips[0]]!=self.config[flips[1]]:
+            #pair exchange, swap the two sites.
+            i,j=flips
+            ups[pos[i]],downs[pos[j]]=(j,i) if self.config[i]==1 else (i,j)
+            pos[i],pos[j]=pos[j],pos[i]
+            return
+        for i in flips:
+            #remove i from its list by moving the last entry to its position, then append it to the other list.
+            if self.config[i]==1:
+                src,dst,nsrc,ndst=ups,downs,self._nup,self._ndown
+            else:
+                src,dst,nsrc,ndst=downs,ups,self._ndown,self._nup
+            last=src[nsrc-1]
+            src[pos[i]]=last; pos[last]=pos[i]
+            dst[ndst]=i; pos[i]=ndst
+            if self.config[i]==1:
+                self._nup,self._ndown=self._nup-1,self._ndown+1
+            else:
+                self._nup,self._ndown=self._nup+1,self._ndown-1
+
+    def _count_update(self,n):
+        '''Count accepted moves, and re-synchronise if needed.'''
+        self._nupdate+=n
+        if self.precision=='single' and self._nupdate>=self.nresync:
+            self.resync()
+
     def pop(self,flips):
         '''
         Probability ratio between fliped config and old config.
@@ -107,16 +345,17 @@ class RBMConfigGenerator(ConfigGenerator):
             :flips: 1darray, positions to flip.
 
         Return:
-            tuple, (new configuration, new theta table, <c'|Psi>/<c|Psi>).
+            tuple, (new theta table, new log(fh(theta)) table, <c'|Psi>/<c|Psi>), the tables are the candidate buffers of this generator.
         '''
         rbm=self.state
-        return fpop_nogroup(config=self.config,flips=asfortranarray(flips),wt=self._WT_nogroup,a=self._a_nogroup,theta=self.theta,fh_id=0)
-        #return pop_nogroup(config=self.config,flips=asarray(flips),W=self._WT_nogroup,a=self._a_nogroup,theta=self.theta)
+        pratio=self._kernel('fpop_group')(config=self.config,flips=flips,wt=self._WT,a=self._a_nogroup,theta=self.theta,lnfh=self.lnfh,ntheta=self._theta,nlnfh=self._lnfh,ngs=self._ngs,fh_id=0)
+        return self._theta,self._lnfh,pratio
+        #_theta,pratio=pop_nogroup(config=self.config,flips=asarray(flips),W=rbm.get_W_nogroup(),a=self._a_nogroup,theta=self.theta)
 
         #if rbm.group.ng==1 or len(rbm.group.ngs)==1:
-        #    return pop1D(config=self.config,flips=asarray(flips),W=rbm.W,a=rbm.a,theta=self.theta,ng=rbm.group.ng)
+        #    _theta,pratio=pop1D(config=self.config,flips=asarray(flips),W=rbm.W,a=rbm.a,theta=self.theta,ng=rbm.group.ng)
         #else:
-        #    return pop2D(config=self.config,flips=asarray(flips),W=rbm.W,a=rbm.a,theta=self.theta,ngs=rbm.group.ngs)
+        #    _theta,pratio=pop2D(config=self.config,flips=asarray(flips),W=rbm.W,a=rbm.a,theta=self.theta,ngs=rbm.group.ngs)
 
         _theta=copy(self.theta)
         nj=rbm.W.shape[1]
@@ -140,6 +379,54 @@ class RBMConfigGenerator(ConfigGenerator):
         pdb.set_trace()
         return _theta,pratio
 
+    def pop_many(self,flips_list):
+        '''
+        Probability ratios between all the fliped configs and the old config, evaluated in one compiled call.
+
+        Parameters:
+            :flips_list: list of 1darray/2darray, positions to flip for each config, a 2darray of shape (nconfig, nfmax) is padded with -1.
+
+        Return:
+            1darray, <c'|Psi>/<c|Psi> for each config, empty flips give 1.
+        '''
+        flips=pad_flips(flips_list)
+        if len(flips)==0:
+            return zeros(0,dtype=self.theta.dtype)
+        if self.cache_size>0:
+            return self._pop_many_cached(flips)
+        return self._kernel('fpop_many')(config=self.config,flips=flips.T,wt=self._WT,a=self._a_nogroup,theta=self.theta,lnfh=self.lnfh,ngs=self._ngs,fh_id=0)
+
+    def _pop_many_cached(self,flips):
+        '''pop_many through the LRU cache of log amplitudes, only missed configs are evaluated.'''
+        nconfig=len(flips)
+        configs=repeat(self.config[newaxis],nconfig,axis=0)
+        mask=flips>=0
+        configs[where(mask)[0],flips[mask]]*=-1
+        #packed words of a config are viewed as one fixed length byte string, the dict key.
+        keys=pack_configs(configs,self._cache_table)
+        keys=ascontiguousarray(keys).view('S%d'%(8*keys.shape[1]))[:,0].tolist()
+        cache=self._cache
+        lnpsi0=self.get_lnpsi()
+        lnpsi=empty(nconfig,dtype='complex128')
+        miss=[]
+        for k,key in enumerate(keys):
+            val=cache.pop(key,None)
+            if val is None:
+                miss.append(k)
+            else:
+                lnpsi[k]=cache[key]=val
+        self.cache_hits+=nconfig-len(miss)
+        self.cache_misses+=len(miss)
+        if len(miss)>0:
+            pratios=self._kernel('fpop_many')(config=self.config,flips=flips[miss].T,wt=self._WT,a=self._a_nogroup,theta=self.theta,lnfh=self.lnfh,ngs=self._ngs,fh_id=0)
+            lnpsi[miss]=lnpsi0+log(asarray(pratios,dtype=lnpsi.dtype))
+            for k in miss:
+                cache[keys[k]]=lnpsi[k]
+            while len(cache)>self.cache_size:
+                cache.popitem(last=False)
+        pratios=exp(lnpsi-lnpsi0)
+        return pratios.real if self.theta.dtype.kind=='f' else pratios
+
     def fire(self):
         '''Fire a proposal.'''
         nsite=self.state.nin
@@ -149,24 +436,202 @@ class RBMConfigGenerator(ConfigGenerator):
             #flips=random.randint(0,nsite,2)       #why this code is wrong?
             #while flips[0]==flips[1]:
                 #flips=random.randint(0,nsite,2)
-            upmask=self.config==1
-            flips=random.randint(0,nsite/2,2)
-            iflip0=where(upmask)[0][flips[0]]
-            iflip1=where(~upmask)[0][flips[1]]
+            #no valid pair if the config is fully polarized, like `fsweep_group`, the move is always rejected.
+            if self._nup==0 or self._ndown==0:
+                return zeros(0,dtype='int64'),0.
+            #pick an up spin and a down spin from the maintained index lists, O(1).
+            r=random.random(2)
+            iflip0=self._ups[int(r[0]*self._nup)]
+            iflip1=self._downs[int(r[1]*self._ndown)]
             flips=array([iflip0,iflip1])
         else:
             iflip0=random.randint(nsite)
             flips=array([iflip0])
 
         #transfer probability is equal, pratio is equal to the probability ratio
-        self._theta,pop1=self.pop(flips=flips)
+        pop1=self.pop(flips=flips)[-1]
         return flips,abs(pop1)**2
 
+    def sweep(self,nstep):
+        '''
+        Perform `nstep` Metropolis proposals in compiled code, config and theta are updated.
+
+        Parameters:
+            :nstep: int, number of proposals.
+
+        Return:
+            int, number of accepted proposals.
+        '''
+        rands=random.random([nstep,3])
+        config,self.theta,self.lnfh,naccept=self._kernel('fsweep_group')(config=self.config,wt=self._WT,a=self._a_nogroup,theta=self.theta,lnfh=self.lnfh,rands=rands.T,ngs=self._ngs,nflip=self.nflip,fh_id=0)
+        self.config[...]=config
+        self._count_update(naccept)
+        if naccept>0 and self.nflip==2: self._build_site_lists()
+        if naccept>0 and self._adj is not None: self.reset_ediag()
+        return naccept
+
     def reject(self,*args,**kwargs):
         #self._theta=None
         pass
 
     def confirm(self,flips,*args,**kwargs):
-        self.theta=self._theta
+        #swap current and candidate buffers.
+        self.theta,self._theta=self._theta,self.theta
+        self.lnfh,self._lnfh=self._lnfh,self.lnfh
+        if self.nflip==2 and self._ups is not None: self._flip_site_lists(flips)
+        if self._adj is not None: self._flip_ediag(flips)
         self.config[flips]*=-1
-        #self._theta=None
+        self._count_update(1)
+
+class BatchRBMConfigGenerator(ConfigGenerator):
+    '''
+    Monte Carlo sampling core that advances a batch of independent Markov chains in lockstep.
+
+    Attributes:
+        :nwalkers: int, number of walkers (Markov chains).
+        :nflip: int, number of spins flipped in a proposal.
+        :state: <RBM>,
+        :config: 2darray, configurations of walkers with shape (nwalkers, nin).
+        :theta: 2darray, theta tables of walkers with shape (nwalkers, nhid).
+        :lnfh: 2darray, log(fh(theta)) tables of walkers.
+        :diag_op: <LinOp>/None, passed to single walker views, whose diagonal energy `ediag` is then available in measurements.
+    '''
+    def __init__(self,nwalkers,nflip,initial_config=None,diag_op=None):
+        self.nwalkers=nwalkers
+        self.nflip=nflip
+        self.diag_op=diag_op
+        self.state=None
+        self.theta=None
+        self.lnfh=None
+        self._W=None
+        self._site_table=None #site_table[i,ig] is the row of W acting on site i in the ig-th hidden group.
+        self._a_nogroup=None
+        self._suffix=''
+        self._theta=None      #update candidates of theta
+        self._lnfh=None       #update candidates of lnfh
+        self._walkers=None    #single walker views used in measurements
+        if hasattr(initial_config,'__iter__'):
+            initial_config=asarray(initial_config)
+            if initial_config.ndim==1:
+                #shuffle the initial config for each walker.
+                initial_config=array([random.permutation(initial_config) for iw in xrange(nwalkers)])
+            if initial_config.shape[0]!=nwalkers: raise ValueError('shape of initial config does not match nwalkers.')
+        self.config=initial_config
+
+    def set_state(self,state):
+        self.state=state
+        if self.config is None:
+            self.config=self.random_config()
+        self.config=asarray(self.config,dtype='int32')
+        self._suffix=get_kernel_suffix(state)
+        self.theta=asarray(state.feed_input(self.config),dtype=KERNEL_DTYPES[self._suffix])
+        self.lnfh=getattr(futils,'flogfh_table'+self._suffix)(self.theta.ravel(),fh_id=0).reshape(self.theta.shape)
+        self._W=ascontiguousarray(state.W)
+        self._site_table=array([state.group.ind_apply(arange(state.nin),-ig)%state.nin for ig in xrange(state.group.ng)]).T
+        self._a_nogroup=state.get_a_nogroup()
+        self._theta=None
+        self._lnfh=None
+
+        #single walker views share memory with the batch tables.
+        WT,ngs=get_folded_WT(state)
+        self._walkers=[]
+        for iw in xrange(self.nwalkers):
+            walker=RBMConfigGenerator(nflip=self.nflip,initial_config=self.config[iw],diag_op=self.diag_op)
+            walker.state=state
+            walker.theta=self.theta[iw]
+            walker.lnfh=self.lnfh[iw]
+            walker._theta=empty_like(walker.theta)
+            walker._lnfh=empty_like(walker.lnfh)
+            walker._WT,walker._ngs=WT,ngs
+            walker._suffix=self._suffix
+            walker._a_nogroup=self._a_nogroup
+            walker._build_site_lists()
+            if self.diag_op is not None:
+                #the adjacency table is shared by walkers.
+                if iw==0:
+                    walker._build_diag()
+                else:
+                    walker._adj,walker._diag_bonds=self._walkers[0]._adj,self._walkers[0]._diag_bonds
+                    walker.reset_ediag()
+            self._walkers.append(walker)
+
+    def get_lnpsi(self):
+        '''Log amplitudes of current configs of all walkers, up to a constant.'''
+        return self.config.dot(self._a_nogroup)+self.lnfh.sum(axis=1)
+
+    def random_config(self):
+        rbm=self.state
+        config=1-2*random.randint(0,2,[self.nwalkers,rbm.nin])
+        return config
+
+    def walker(self,iw):
+        '''
+        Get the single walker view of the iw-th walker, used in local measurements.
+
+        Parameters:
+            :iw: int, the walker index.
+
+        Return:
+            <RBMConfigGenerator>, sharing config and theta with this batch.
+        '''
+        walker=self._walkers[iw]
+        #batch moves do not patch the tables derived from config.
+        walker._build_site_lists()
+        if walker._adj is not None: walker.reset_ediag()
+        return walker
+
+    def pop(self,flips):
+        '''
+        Probability ratio between fliped configs and old configs for all walkers.
+
+        Parameters:
+            :flips: 2darray, positions to flip with shape (nwalkers, nflip).
+
+        Return:
+            tuple, (new theta table, new log(fh(theta)) table, <c'|Psi>/<c|Psi>) for all walkers.
+        '''
+        cflip=self.config[arange(self.nwalkers)[:,newaxis],flips]
+        nw,nflip=flips.shape
+        W_flips=self._W[self._site_table[flips]].reshape([nw,nflip,-1])  #rows of the unfolded W on flipped sites.
+        ntheta=self.theta-2*(cflip[:,:,newaxis]*W_flips).sum(axis=1)
+        nlnfh=getattr(futils,'flogfh_table'+self._suffix)(ntheta.ravel(),fh_id=0).reshape(ntheta.shape)
+        pratio=exp(-2*(cflip*self._a_nogroup[flips]).sum(axis=1)+(nlnfh-self.lnfh).sum(axis=1))
+        return ntheta,nlnfh,pratio
+
+    def fire(self):
+        '''Fire a proposal for each walker.'''
+        nsite=self.state.nin
+        if self.nflip==2:
+            #pick an up spin and a down spin for each walker uniformly by masked random keys.
+            keys=random.random(self.config.shape)
+            upmask=self.config==1
+            iflip0=where(upmask,keys,-1).argmax(axis=1)
+            iflip1=where(~upmask,keys,-1).argmax(axis=1)
+            flips=concatenate([iflip0[:,newaxis],iflip1[:,newaxis]],axis=1)
+            #walkers without an up or a down spin have no valid pair, their proposals are always rejected.
+            invalid=~(upmask.any(axis=1)&~upmask.all(axis=1))
+        else:
+            flips=random.randint(0,nsite,[self.nwalkers,1])
+            invalid=None
+
+        self._theta,self._lnfh,pop1=self.pop(flips=flips)
+        pratio=abs(pop1)**2
+        if invalid is not None: pratio[invalid]=0
+        return flips,pratio
+
+    def reject(self,*args,**kwargs):
+        pass
+
+    def confirm(self,flips,mask,*args,**kwargs):
+        '''
+        Confirm proposals of accepted walkers.
+
+        Parameters:
+            :flips: 2darray, the proposals.
+            :mask: 1darray, boolean mask of accepted walkers.
+        '''
+        #update in place to keep single walker views valid.
+        self.theta[mask]=self._theta[mask]
+        self.lnfh[mask]=self._lnfh[mask]
+        iw=where(mask)[0]
+        self.config[iw[:,newaxis],flips[iw]]*=-1
@@ -135,6 +135,34 @@ class DBM(object):
         return concatenate([b for b,mask in zip(self.b_L,self.var_mask[:self.num_layers]) if mask]+\
                 [W.ravel() for W,mask in zip(self.W_L,self.var_mask[self.num_layers:]) if mask])
 
+    def get_param_blocks(self,by='var'):
+        '''
+        Get blocks of variational parameters.
+
+        Parameters:
+            :by: 'var'/'hidden', 'var' for a block of each bias and weight, 'hidden' for the input bias block and
+                a block for each hidden unit (its bias and incoming weights).
+
+        Return:
+            list, indices of parameters (in `dump_arr`) of each block.
+        '''
+        arrs=self.b_L+self.W_L
+        sizes=[x.size for x in arrs]
+        offset=cumsum([0]+[n*mask for n,mask in zip(sizes,self.var_mask)])
+        if by=='var':
+            return [arange(offset[i],offset[i]+sizes[i]) for i in xrange(len(arrs)) if self.var_mask[i]]
+        elif by=='hidden':
+            blocks=[]
+            if self.var_mask[0]: blocks.append(arange(offset[0],offset[0]+sizes[0]))
+            for l in xrange(1,self.num_layers):
+                iW=self.num_layers+l-1
+                nl,nr=self.W_L[l-1].shape
+                for j in xrange(nr):
+                    blocks.append(concatenate([[offset[l]+j] if self.var_mask[l] else [],offset[iW]+arange(nl)*nr+j if self.var_mask[iW] else []]).astype('int64'))
+            return blocks
+        else:
+            raise ValueError('unknown block type %s'%by)
+
     def load_arr(self,v):
         '''Load data from an array.'''
         offset=0
@@ -51,9 +51,11 @@ class OpQueue(LinOp):
     Attributes:
         :op_base: tuple, linear operators.
         :op_derive: tuple, functions that decide derived operators (used in local measurements).
+        :bin_types: list/None, the class (or factory) of binning statistics for each operator, None to use the default of measurement engine.
     '''
-    def __init__(self,op_base,op_derive):
+    def __init__(self,op_base,op_derive,bin_types=None):
         self.op_base,self.op_derive=op_base,op_derive
+        self.bin_types=bin_types
 
     @property
     def nop(self):
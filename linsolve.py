@@ -0,0 +1,187 @@
+'''
+Linear solvers for the SR system S x = F.
+'''
+
+from numpy import *
+from scipy.linalg import cho_factor,cho_solve,ldl,solve_triangular,solve_banded,eigh,LinAlgError
+from scipy.sparse.linalg import LinearOperator,aslinearoperator,cg,minres
+import time,pdb
+
+__all__=['LinSolver','IdentitySolver','CholSolver','EighSolver','IterSolver','get_solver']
+
+def _realify(x):
+    '''Stack real and imaginary parts of a complex vector.'''
+    return concatenate([x.real,x.imag])
+
+class LinSolver(object):
+    '''
+    Base class of solvers for hermitian positive (semi-)definite systems, call it with (S, F) to get x.
+
+    Attributes:
+        :iprint: int, print the timing of each solve if > 0.
+        :timings: list, wall time of each solve.
+    '''
+    def __init__(self,iprint=0):
+        self.iprint=iprint
+        self.timings=[]
+
+    def __call__(self,S,F):
+        t0=time.time()
+        x=self.solve(S,F)
+        self.timings.append(time.time()-t0)
+        if self.iprint>0: print '%s solved %s system in %.4f s.'%(self.__class__.__name__,len(F),self.timings[-1])
+        return x
+
+    def solve(self,S,F):
+        '''
+        Solve S x = F.
+
+        Parameters:
+            :S: 2darray/LinearOperator, the hermitian matrix.
+            :F: 1darray, the right hand side.
+
+        Return:
+            1darray, x.
+        '''
+        raise NotImplementedError()
+
+class IdentitySolver(LinSolver):
+    '''Take S as identity, x = F.'''
+    def solve(self,S,F):
+        return F
+
+class CholSolver(LinSolver):
+    '''
+    Factorised solver.
+
+    Attributes:
+        :method: 'cholesky'/'ldl', LDL^H (Bunch-Kaufman) is used for indefinite matrices,
+            'cholesky' falls back to it if S is not positive definite.
+    '''
+    def __init__(self,method='cholesky',iprint=0):
+        super(CholSolver,self).__init__(iprint)
+        self.method=method
+
+    def solve(self,S,F):
+        if self.method=='cholesky':
+            try:
+                return cho_solve(cho_factor(S,lower=True),F)
+            except LinAlgError:
+                if self.iprint>0: print 'Warning: S is not positive definite, fall back to LDL.'
+        lu,d,perm=ldl(S,lower=True,hermitian=True)
+        L=lu[perm]
+        y=solve_triangular(L,F[perm],lower=True,unit_diagonal=True)
+        #d is block diagonal with 1x1 and 2x2 blocks.
+        n=len(d)
+        ab=zeros((3,n),dtype=d.dtype)
+        ab[0,1:]=d.diagonal(1)
+        ab[1]=d.diagonal()
+        ab[2,:-1]=d.diagonal(-1)
+        z=solve_banded((1,1),ab,y)
+        x=empty_like(z)
+        x[perm]=solve_triangular(L.T.conj(),z,lower=False,unit_diagonal=True)
+        return x
+
+class EighSolver(LinSolver):
+    '''
+    Solver by eigen decomposition, discarding near singular values.
+
+    Attributes:
+        :eps_trunc: float, eigenvalues with s/s_max < eps_trunc are discarded.
+        :eigbasis: tuple, (L, U), eigenvalues and eigenvectors of the last solve.
+    '''
+    def __init__(self,eps_trunc=1e-12,iprint=0):
+        super(EighSolver,self).__init__(iprint)
+        self.eps_trunc=eps_trunc
+        self.eigbasis=None
+
+    def solve(self,S,F):
+        L,U=eigh(S)
+        self.eigbasis=(L,U)
+        kpmask=L/L[-1]>self.eps_trunc
+        U=U[:,kpmask]
+        return (U/L[kpmask]).dot(U.T.conj().dot(F))
+
+class IterSolver(LinSolver):
+    '''
+    Iterative solver, warm-started from the last solution.
+
+    Attributes:
+        :method: 'cg'/'minres'.
+        :tol: float, tolerance.
+        :maxiter: int/None, the maximum number of iterations.
+        :precond: None/'eig'/<EighSolver>, with 'eig' the eigenbasis of S is computed every `nrefresh` solves and reused as preconditioner
+            M = U diag(1/L) U^H for the following ones (a matrix-free S is formed densely by matvecs on refresh steps),
+            an <EighSolver> shares its last eigenbasis instead.
+        :nrefresh: int, refresh period of the eigenbasis.
+        :eps_precond: float, eigenvalues of the preconditioner are clipped at eps_precond*s_max.
+        :niters: list, number of iterations of each solve.
+    '''
+    def __init__(self,method='cg',tol=1e-6,maxiter=None,precond=None,nrefresh=10,eps_precond=1e-8,iprint=0):
+        super(IterSolver,self).__init__(iprint)
+        self.method,self.tol,self.maxiter=method,tol,maxiter
+        self.precond,self.nrefresh,self.eps_precond=precond,nrefresh,eps_precond
+        self._x=None
+        self._eigbasis=None
+        self._counter=0
+        self.niters=[]
+
+    def get_precond(self,S):
+        '''Get the preconditioner from the reused eigenbasis.'''
+        if self.precond is None: return None
+        if self.precond=='eig':
+            if self._counter%self.nrefresh==0 or self._eigbasis is None or len(self._eigbasis[0])!=S.shape[0]:
+                if not isinstance(S,ndarray):
+                    A=aslinearoperator(S)
+                    S=A.matmat(eye(A.shape[1],dtype=A.dtype))
+                self._eigbasis=eigh(S)
+            L,U=self._eigbasis
+        else:
+            if self.precond.eigbasis is None: return None
+            L,U=self.precond.eigbasis
+        Linv=1./maximum(L,self.eps_precond*L[-1])
+        return LinearOperator(S.shape,matvec=lambda x:U.dot(Linv*U.T.conj().dot(x)),dtype=U.dtype)
+
+    def solve(self,S,F):
+        n=len(F)
+        A=aslinearoperator(S)
+        M=self.get_precond(S)
+        x0=self._x if self._x is not None and self._x.shape==F.shape else None
+        self._counter+=1
+        self.niters.append(0)
+        def callback(xk):
+            self.niters[-1]+=1
+        if self.method=='minres' and (iscomplexobj(F) or A.dtype.kind=='c'):
+            #minres works on the equivalent real symmetric system of twice the size.
+            realify=lambda L:LinearOperator((2*n,2*n),matvec=lambda y:_realify(L.matvec(y[:n]+1j*y[n:])),dtype='float64')
+            y,info=minres(realify(A),_realify(F),x0=None if x0 is None else _realify(x0),M=None if M is None else realify(M),tol=self.tol,maxiter=self.maxiter,callback=callback)
+            x=y[:n]+1j*y[n:]
+        else:
+            x,info=(cg if self.method=='cg' else minres)(A,F,x0=x0,M=M,tol=self.tol,maxiter=self.maxiter,callback=callback)
+        if info>0: print 'Warning: %s not converged in %s iterations.'%(self.method,info)
+        self._x=x
+        return x
+
+def get_solver(reg_params,iprint=0):
+    '''
+    Get the default solver for a regularization method.
+
+    Parameters:
+        :reg_params: (str,dict), see <SR>.
+
+    Return:
+        <LinSolver>,
+    '''
+    reg_method,reg_var=reg_params
+    if reg_method in ['carleo','delta','block','diag']:
+        return CholSolver(iprint=iprint)
+    elif reg_method=='trunc':
+        return EighSolver(eps_trunc=reg_var.get('eps_trunc',1e-3),iprint=iprint)
+    elif reg_method=='pinv':
+        return EighSolver(eps_trunc=1e-12,iprint=iprint)
+    elif reg_method=='identity':
+        return IdentitySolver(iprint=iprint)
+    elif reg_method in ['cg','minres']:
+        return IterSolver(reg_method,tol=reg_var.get('tol',1e-6),maxiter=reg_var.get('maxiter',None),iprint=iprint)
+    else:
+        raise ValueError('unknown regularization method %s'%reg_method)
@@ -8,7 +8,7 @@ from scipy.special import expit
 
 from sstate import SparseState
 from group import NoGroup
-from utils import fh
+from utils import fh,logfh
 
 __all__=['RBM','random_rbm']
 
@@ -90,7 +90,9 @@ class RBM(object):
         Return:
             1darray, raw output in hidden nodes.
         '''
-        res=v.dot(self.get_W_nogroup())+self.get_b_nogroup()
+        #theta of the ig-th hidden group is (g_ig config).dot(W), avoiding to unfold W.
+        vg=self.group.apply_all(v)
+        res=rollaxis(vg.dot(self.W),0,vg.ndim-1).reshape(v.shape[:-1]+(-1,))+self.get_b_nogroup()
         if self.hidden_node_type=='binary':
             return expit(res)
         else:
@@ -138,10 +140,49 @@ class RBM(object):
         if theta is None: theta=self.feed_input(config)
         return exp(sum([group.apply(asarray(config),ig).dot(self.a) for ig in xrange(group.ng)],axis=0))*prod(fh(theta),axis=-1)
 
+    def get_lnweight(self,config,theta=None):
+        '''
+        Get the log weight for specific configurations, up to a constant.
+
+        Parameters:
+            :config: 1darray/2darray, a configuration or a batch of them in rows.
+            :theta: 1darray/2darray/None, table of hidden layer output.
+
+        Return:
+            number/1darray,
+        '''
+        if theta is None: theta=self.feed_input(config)
+        return asarray(config).dot(self.get_a_nogroup())+logfh(theta).sum(axis=-1)
+
     def dump_arr(self):
         '''Dump values to an array.'''
         return concatenate([x for i,x in enumerate([self.a,self.b,self.W.ravel()]) if self.var_mask[i]])
 
+    def get_param_blocks(self,by='var'):
+        '''
+        Get blocks of variational parameters.
+
+        Parameters:
+            :by: 'var'/'hidden', 'var' for a, b and W blocks, 'hidden' for the a block and a block for each hidden unit (b_j and W[:,j]).
+
+        Return:
+            list, indices of parameters (in `dump_arr`) of each block.
+        '''
+        nb=self.nhid/self.group.ng
+        nin=self.nin
+        oa,ob,oW=cumsum([0]+[n*mask for n,mask in zip([nin,nb,nin*nb],self.var_mask)])[:3]
+        blocks=[]
+        if self.var_mask[0]: blocks.append(arange(oa,oa+nin))
+        if by=='var':
+            if self.var_mask[1]: blocks.append(arange(ob,ob+nb))
+            if self.var_mask[2]: blocks.append(arange(oW,oW+nin*nb))
+        elif by=='hidden':
+            for j in xrange(nb):
+                blocks.append(concatenate([[ob+j] if self.var_mask[1] else [],oW+arange(nin)*nb+j if self.var_mask[2] else []]).astype('int64'))
+        else:
+            raise ValueError('unknown block type %s'%by)
+        return blocks
+
     def load_arr(self,v):
         '''Load data from an array.'''
         nb=self.nhid/self.group.ng
@@ -3,13 +3,20 @@ Stochestic Reconfiguration.
 '''
 
 from numpy import *
-from scipy.linalg import pinv,inv,norm,eigh
+from scipy.linalg import norm,eigh
+from scipy.sparse.linalg import LinearOperator
 import pdb
 
 from linop import PartialW,OpQueue
+from binner import SampleBin
+from linsolve import get_solver,IdentitySolver
+from vmc import importance_weights
 
 __all__=['SR','SD']
 
+#regularization methods that never form S.
+MATRIX_FREE_METHODS=['cg','minres','block','diag']
+
 class SR(object):
     '''
     Stochestic Reconfiguration optimization problem.
@@ -17,7 +24,7 @@ class SR(object):
     Attributes:
         :H: LinOp, Hamiltonian.
         :rbm: <RBM>, the state.
-        :handler: <VMC>/..., the object with @measure(op) method.
+        :handler: <VMC>/..., the object with @measure(op) method, e.g. <FakeVMC> for dense S only.
         :niter: int, number of iteration.
         :reg_params: (str,dict), tuple of (method name, parameter dict) for regularization of S matrix. Methods are
 
@@ -26,52 +33,201 @@ class SR(object):
             * 'trunc' -> carleo's approach S_{kk}*(1+lambda0), diacarding near singular values (s/s_max < eps_trunc).
             * 'pinv'  -> use pseudo inverse instead.
             * 'identity' -> equivalence to SD.
+            * 'cg'/'minres' -> matrix-free S_{kk'}^{reg} = S_{kk'} + \lambda_0 \delta_{kk'}, solved by conjugate gradient/MINRES,
+              S is never formed, S v = O^H(O v)/N with the centred sample matrix O. Parameters are lambda0, tol and maxiter,
+              the solver is warm-started from the last update.
+            * 'block' -> S_{kk'}^{reg} = S_{kk'} + \lambda_0 \delta_{kk'}, inverted only within blocks of parameters,
+              parameter 'by' is 'var' (blocks of `rbm.var_mask`) or 'hidden' (a block for each hidden unit, b_j and W[:,j]), see `rbm.get_param_blocks`.
+            * 'diag' -> S_{kk'}^{reg} = (S_{kk} + \lambda_0) \delta_{kk'}, keep the diagonal part of S only.
+        :nsample_block: int/None, if not None, samples of (O_k, E_loc) are stored in blocks of this size (the handler needs @measure_bins),
+            S and F are formed with one GEMM per block instead of an outer product per sample, matrix-free methods use 1000 by default.
+        :sample_space: bool, solve the nsample x nsample system T = O O^H instead (for 'delta', 'carleo' and 'trunc', the latter truncates the spectrum of T),
+            which is cheaper if nparam > nsample, the update is mapped back by x = O^H y.
+        :solver: <LinSolver>/None, solver for the regularized system, the default is chosen by `linsolve.get_solver(reg_params)`,
+            e.g. Cholesky for 'delta' and 'carleo', eigen decomposition for 'trunc' and 'pinv', `IterSolver` for 'cg' and 'minres'.
     '''
-    def __init__(self,H,rbm,handler,reg_params=('delta',{})):
+    def __init__(self,H,rbm,handler,reg_params=('delta',{}),nsample_block=None,sample_space=False,solver=None):
         self.H=H
         self.rbm=rbm
         self.handler=handler
         self.reg_params=reg_params
-        self._opq=OpQueue((PartialW(),H),(lambda a,b:a[:,newaxis].conj()*a,lambda a,b:a.conj()*b))
+        self.sample_space=sample_space
+        matrix_free=reg_params[0] in MATRIX_FREE_METHODS or sample_space
+        if matrix_free and nsample_block is None: nsample_block=1000
+        self.nsample_block=nsample_block
+        if nsample_block is not None and not hasattr(handler,'measure_bins'):
+            raise TypeError('sampled blocks, matrix-free methods and sample space SR need a handler with @measure_bins (e.g. <VMC>), got %s.'%handler.__class__.__name__)
+        if nsample_block is None:
+            self._opq=OpQueue((PartialW(),H),(lambda a,b:a[:,newaxis].conj()*a,lambda a,b:a.conj()*b))
+        else:
+            self._opq=OpQueue((PartialW(),H),(lambda a,b:append(a,b),),bin_types=[None,None,lambda:SampleBin(nsample_block,keep_samples=matrix_free)])
         self._opq_vals=None
         self._counter=0
+        self.solver=get_solver(reg_params) if solver is None else solver
+
+    def measure_SF(self):
+        '''
+        Measure the S matrix and the force F, the mean values of operators in queue are kept in `_opq_vals`.
+
+        Return:
+            tuple, (S, F).
+        '''
+        if self.nsample_block is None:
+            self._opq_vals=self.handler.measure(self._opq,self.rbm,tol=0)
+            OPW,OH,OPW2,OPWH=self._opq_vals
+            S=OPW2-OPW[:,newaxis].conj()*OPW
+            F=OPWH-OPW.conj()*OH
+        else:
+            bins=self.handler.measure_bins(self._opq,self.rbm,tol=0)
+            self._opq_vals=[b.mean() for b in bins]
+            C=bins[2].cov()
+            S,F=C[:-1,:-1],C[:-1,-1]
+        return S,F
+
+    def measure_samples(self):
+        '''
+        Measure the centred samples of O_k and E_loc, the mean values of operators in queue are kept in `_opq_vals`.
+
+        Return:
+            tuple, (O, E), O is the sample matrix of shape (nsample, nparam).
+        '''
+        bins=self.handler.measure_bins(self._opq,self.rbm,tol=0)
+        self._opq_vals=[b.mean() for b in bins]
+        X=bins[2].get_samples(centred=True)
+        return X[:,:-1],X[:,-1]
+
+    def _solve_matrix_free(self,O,E):
+        '''Solve (S+lambda0)x=F without forming S.'''
+        reg_method,reg_var=self.reg_params
+        lambda0=reg_var.get('lambda0',1e-4)
+        N,nparam=O.shape
+        F=O.T.conj().dot(E)/N
+        Sop=LinearOperator((nparam,nparam),matvec=lambda x:O.T.conj().dot(O.dot(x))/N+lambda0*x,dtype=result_type(O.dtype,F.dtype))
+        return self.solver(Sop,F)
+
+    def _solve_block(self,O,E):
+        '''Solve (S+lambda0)x=F with S truncated to its diagonal blocks.'''
+        reg_method,reg_var=self.reg_params
+        lambda0=reg_var.get('lambda0',1e-4)
+        N,nparam=O.shape
+        F=O.T.conj().dot(E)/N
+        if reg_method=='diag':
+            return F/((abs(O)**2).sum(axis=0)/N+lambda0)
+        ds=zeros(nparam,dtype=F.dtype)
+        for inds in self.rbm.get_param_blocks(by=reg_var.get('by','var')):
+            Ob=O[:,inds]
+            Sb=Ob.T.conj().dot(Ob)/N
+            fill_diagonal(Sb,Sb.diagonal()+lambda0)
+            ds[inds]=self.solver(Sb,F[inds])
+        return ds
+
+    def _solve_sample_space(self,O,E):
+        '''
+        Solve (S+D)x=F in sample space, D is the diagonal regularization.
+
+        With A = O d^{-1}/sqrt(N) and d^2 = D, x = d^{-1} A^H (A A^H + 1)^{-1} E/sqrt(N).
+        For 'trunc', eigenvalues s of A A^H with s/s_max < eps_trunc are discarded before the identity is added.
+        '''
+        reg_method,reg_var=self.reg_params
+        N,nparam=O.shape
+        Skk=(abs(O)**2).sum(axis=0)/N
+        if reg_method=='carleo':
+            lambda0,b=reg_var.get('lambda0',100),reg_var.get('b',0.9)
+            lamb=max(lambda0*b**self._counter,1e-4)
+            D=Skk*lamb+1e-8
+        elif reg_method=='delta':
+            D=reg_var.get('lambda0',1e-4)*ones(nparam)
+        elif reg_method=='trunc':
+            lambda0=reg_var.get('lambda0',0.2)
+            D=maximum(Skk*lambda0,1e-8)
+        else:
+            raise ValueError('%s is not supported in sample space.'%reg_method)
+        d=sqrt(D)
+        A=O/(d*sqrt(N))
+        T=A.dot(A.T.conj())
+        if reg_method=='trunc':
+            #the spectrum of T+1 is bounded by 1 from below, truncate on that of T.
+            L,U=eigh(T)
+            kpmask=L/L[-1]>reg_var.get('eps_trunc',1e-3)
+            U=U[:,kpmask]
+            y=(U/(L[kpmask]+1)).dot(U.T.conj().dot(E))
+        else:
+            fill_diagonal(T,T.diagonal()+1)
+            y=self.solver(T,E)
+        return A.T.conj().dot(y)/(d*sqrt(N))
 
     def compute_gradient(self,v):
         reg_method,reg_var=self.reg_params
         #update RBM
         self.rbm.load_arr(v)
 
+        if self.sample_space:
+            ds=self._solve_sample_space(*self.measure_samples())
+            self._counter+=1
+            return ds
+        if reg_method in ['block','diag']:
+            self._counter+=1
+            return self._solve_block(*self.measure_samples())
+        if reg_method in MATRIX_FREE_METHODS:
+            self._counter+=1
+            return self._solve_matrix_free(*self.measure_samples())
+
         #perform measurements
-        self._opq_vals=self.handler.measure(self._opq,self.rbm,tol=0)
-        OPW,OH,OPW2,OPWH=self._opq_vals
-        S=OPW2-OPW[:,newaxis].conj()*OPW
-        F=OPWH-OPW.conj()*OH
+        S,F=self.measure_SF()
 
-        #regularize S matrix to get Sinv.
+        #regularize S matrix, then solve S x = F.
         if reg_method=='carleo':
             lambda0,b=reg_var.get('lambda0',100),reg_var.get('b',0.9)
             lamb=max(lambda0*b**self._counter,1e-4)
             fill_diagonal(S,S.diagonal()*(1+lamb)+1e-8)
-            Sinv=inv(S)
         elif reg_method=='delta':
             lambda0=reg_var.get('lambda0',1e-4)
             fill_diagonal(S,S.diagonal()+lambda0)
-            Sinv=inv(S)
         elif reg_method=='trunc':
-            eps_trunc,lambda0=reg_var.get('eps_trunc',1e-3),reg_var.get('lambda0',0.2)
+            lambda0=reg_var.get('lambda0',0.2)
             fill_diagonal(S,S.diagonal()*(1+lambda0))
-            L,U=eigh(S)
-            kpmask=L/L[-1]>eps_trunc
-            U=U[:,kpmask]
-            Sinv=(U/L[kpmask]).dot(U.T.conj())
-        elif reg_method=='pinv':
-            Sinv=pinv(S)
-        elif reg_method=='identity':
-            Sinv=identity(len(S))
-        else:
+        elif reg_method not in ['pinv','identity']:
             raise ValueError()
         self._counter+=1
-        return Sinv.dot(F)
+        return self.solver(S,F)
+
+    def line_search(self,v,ds,steps=[0.,0.25,0.5,1.,2.],ess_min=0.5):
+        '''
+        Correlated sampling line search along -ds, energies at v-t*ds are estimated on the configurations sampled at v,
+        reweighted by |psi(v-t*ds)/psi(v)|^2, no new Markov chain is needed.
+
+        The handler should keep the configurations of its last measurement (e.g. <VMC> with keep_configs=True),
+        call it right after `compute_gradient(v)`, and update the parameters by v-t*ds.
+
+        Parameters:
+            :v: 1darray, the current parameters.
+            :ds: 1darray, the update direction returned by `compute_gradient`.
+            :steps: list, step lengths t to try.
+            :ess_min: float, steps with effective sample size below ess_min*nsample are rejected.
+
+        Return:
+            tuple, (t, energies), the step with the lowest energy and the energy of each step (nan for rejected ones).
+        '''
+        handler=self.handler
+        if not hasattr(handler,'local_values'):
+            raise TypeError('line search needs a sampling handler with @local_values (e.g. <VMC>), got %s.'%handler.__class__.__name__)
+        configs=getattr(handler,'configs',None)
+        if configs is None:
+            raise ValueError('handler does not keep sampled configurations, set keep_configs=True and call compute_gradient first.')
+        rbm=self.rbm
+        rbm.load_arr(v)
+        lnpsi0=rbm.get_lnweight(configs)
+        el=[]
+        for t in steps:
+            rbm.load_arr(v-t*ds)
+            w,ess=importance_weights(rbm.get_lnweight(configs),lnpsi0)
+            if ess<ess_min*len(configs):
+                el.append(nan)
+            else:
+                el.append(w.dot(handler.local_values(self.H,rbm,configs)).real)
+        rbm.load_arr(v)
+        el=array(el)
+        return steps[nanargmin(el)],el
 
 class SD(object):
     '''
@@ -80,12 +236,14 @@ class SD(object):
     Attributes:
         :H: LinOp, Hamiltonian.
         :rbm: <RBM>, the state.
-        :handler: <VMC>/..., the object with @measure(op) method.
+        :handler: <VMC>/..., the object with @measure(op) method, e.g. <FakeVMC> for dense S only.
+        :solver: <LinSolver>, solver applied to the force, <IdentitySolver> by default.
     '''
-    def __init__(self,H,rbm,handler):
+    def __init__(self,H,rbm,handler,solver=None):
         self.H=H
         self.rbm=rbm
         self.handler=handler
+        self.solver=IdentitySolver() if solver is None else solver
         self._opq=OpQueue((PartialW(),H),(lambda a,b:a.conj()*b,))
         self._opq_vals=None
         self._counter=0
@@ -100,4 +258,4 @@ class SD(object):
         OPW,OH,OPWH=self._opq_vals; OH=OH.real
         F=OPWH-OPW.conj()*OH
         self._counter+=1
-        return F
+        return self.solver(None,F)
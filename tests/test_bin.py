@@ -40,5 +40,70 @@ def test_bin():
     assert_allclose(bb.mean(),mean(a+b+c,axis=0))
     pdb.set_trace()
 
+def test_streambin():
+    print 'Test StreamBin.'
+    #AR(1) series with autocorrelation.
+    x=zeros([4096,2,2])
+    noise=random.randn(*x.shape)
+    for i in xrange(1,len(x)):
+        x[i]=0.8*x[i-1]+noise[i]
+    sb,bb=StreamBin(nlevel=12),Bin()
+    for block in split(x,64):
+        sb.push(block)
+        bb.push(block)
+    print sb
+    sb.print_stat()
+    assert_allclose(sb.mean(),bb.mean())
+    assert_allclose(sb.var_unbinned(),bb.var_unbinned())
+    #level 6 entries are the block means of Bin.
+    assert_allclose(sb.var(6),bb.var())
+    assert_allclose(sb.std_err(6),bb.std_err())
+    assert_allclose(sb.t_auto(6),bb.t_auto())
+
+    print 'Test merging StreamBin.'
+    sb1,sb2=StreamBin(nlevel=12),StreamBin(nlevel=12)
+    sb1.push(x[:1000]); sb2.push(x[1000:])
+    sb1.merge(sb2)
+    assert_allclose(sb1.mean(),sb.mean())
+    assert_allclose(sb1.var(0),sb.var(0))
+    assert_(sb1.counts[0]==len(x) and sb1.counts[1]==len(x)/2)
+
+def test_samplebin():
+    print 'Test SampleBin.'
+    x=random.randn(1000,5)+1j*random.randn(1000,5)
+    xc=x-x.mean(axis=0)
+    cov=xc.T.conj().dot(xc)/len(x)
+    for keep_samples in [False,True]:
+        sb1,sb2=SampleBin(nsample_block=64,keep_samples=keep_samples),SampleBin(nsample_block=100,keep_samples=keep_samples)
+        for block in split(x[:600],6): sb1.push(block)
+        sb2.push(x[600:])
+        sb1.merge(sb2)
+        print sb1
+        assert_allclose(sb1.mean(),x.mean(axis=0))
+        assert_allclose(sb1.cov(),cov)
+        assert_allclose(sb1.var(),var(x,axis=0,ddof=1))
+        if keep_samples: assert_allclose(sb1.get_samples(),x)
+
+    print 'Test weighted samples.'
+    w=random.random(len(x))
+    xm=w.dot(x)/w.sum()
+    xc=x-xm
+    cov=(xc.T.conj()*w).dot(xc)/w.sum()
+    bb=Bin()
+    bb.push(x[:500],weights=w[:500]); bb.push(x[500:],weights=w[500:])
+    assert_allclose(bb.mean(),xm)
+    assert_allclose(sum(bb.n),w.sum())
+    for keep_samples in [False,True]:
+        sb=SampleBin(nsample_block=64,keep_samples=keep_samples)
+        sb.push(x[:500],weights=w[:500]); sb.push(x[500:],weights=w[500:])
+        assert_allclose(sb.mean(),xm)
+        assert_allclose(sb.cov(),cov)
+        if keep_samples:
+            X=sb.get_samples(centred=True)
+            assert_allclose(X.T.conj().dot(X)/len(X),cov)
+    assert_raises(TypeError,StreamBin().push,x,weights=w)
+
 if __name__=='__main__':
     test_bin()
+    test_streambin()
+    test_samplebin()
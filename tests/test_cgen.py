@@ -0,0 +1,137 @@
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+from matplotlib.pyplot import *
+import sys,pdb,time
+from os import path
+sys.path.insert(0,'../')
+
+from rbm import *
+from cgen import *
+from group import *
+from toymodel import *
+
+random.seed(2)
+
+def test_pop_group():
+    print 'Testing pop with folded W.'
+    for group,dtype in [(NoGroup(),'complex128'),(TIGroup([6]),'complex128'),(TIGroup([2,3]),'complex128'),(NoGroup(),'float64'),(TIGroup([2,3]),'float64')]:
+        print 'Group = %s, dtype = %s'%(group,dtype)
+        rbm=random_rbm(nin=6,nhid=12,group=group,dtype=dtype)
+        rbm.W*=50
+        cg=RBMConfigGenerator(nflip=2,initial_config=[1,-1,1,-1,-1,1])
+        cg.set_state(rbm)
+        assert_allclose(cg.theta,rbm.get_W_nogroup().T.dot(cg.config)+rbm.get_b_nogroup())
+        assert_(cg.theta.dtype==dtype)
+        for flips in [[0,1],[2,4],[5,3]]:
+            nc=copy(cg.config); nc[flips]*=-1
+            ntheta,nlnfh,pratio=cg.pop(array(flips))
+            assert_allclose(ntheta,rbm.feed_input(nc))
+            assert_allclose(pratio,rbm.get_weight(nc)/rbm.get_weight(cg.config))
+
+        print 'Testing sweep.'
+        cg.sweep(100)
+        assert_allclose(cg.theta,rbm.feed_input(cg.config))
+        assert_allclose(cg.lnfh,log(cosh(cg.theta)))
+
+def test_single_precision():
+    print 'Testing single precision sampling.'
+    for dtype in ['complex128','float64']:
+        rbm=random_rbm(nin=6,nhid=12,group=TIGroup([6]),dtype=dtype)
+        rbm.W*=50
+        cg=RBMConfigGenerator(nflip=1,initial_config=[1,-1,1,-1,-1,1],precision='single',nresync=50)
+        cg.set_state(rbm)
+        assert_(cg.theta.dtype==('complex64' if dtype=='complex128' else 'float32'))
+        nc=copy(cg.config); nc[[2]]*=-1
+        assert_allclose(cg.pop(array([2]))[-1],rbm.get_weight(nc)/rbm.get_weight(cg.config),rtol=1e-4)
+        cg.sweep(1000)
+        assert_allclose(cg.theta,rbm.feed_input(cg.config),atol=1e-4)
+
+def test_site_lists():
+    print 'Testing up/down site lists for pair exchange proposals.'
+    rbm=random_rbm(nin=8,nhid=8,group=TIGroup([8]))
+    cg=RBMConfigGenerator(nflip=2,initial_config=[1,-1,1,-1,-1,1,1,-1])
+    cg.set_state(rbm)
+    for i in xrange(200):
+        flips,pratio=cg.fire()
+        assert_(cg.config[flips[0]]==1 and cg.config[flips[1]]==-1)
+        if i%3==0: cg.confirm(flips)
+        if i%50==0: cg.sweep(10)
+        ups,downs=cg._ups[:cg._nup],cg._downs[:cg._ndown]
+        assert_allclose(sort(ups),where(cg.config==1)[0])
+        assert_allclose(sort(downs),where(cg.config==-1)[0])
+        assert_allclose(cg._pos[ups],arange(cg._nup))
+        assert_allclose(cg._pos[downs],arange(cg._ndown))
+    #a fully polarized config has no pair to exchange.
+    cg=RBMConfigGenerator(nflip=2,initial_config=[1]*8)
+    cg.set_state(rbm)
+    flips,pratio=cg.fire()
+    assert_(len(flips)==0 and pratio==0)
+
+def test_pop_many():
+    print 'Testing batched pop.'
+    for group,dtype,precision in [(TIGroup([6]),'complex128','double'),(TIGroup([2,3]),'float64','double'),(NoGroup(),'complex128','single')]:
+        rbm=random_rbm(nin=6,nhid=12,group=group,dtype=dtype)
+        cg=RBMConfigGenerator(nflip=2,initial_config=[1,-1,1,-1,-1,1],precision=precision)
+        cg.set_state(rbm)
+        flips_list=[array([],dtype='int64'),array([3]),array([0,1]),array([5,2])]
+        pratios=cg.pop_many(flips_list)
+        assert_allclose(pratios,[1]+[cg.pop(f)[-1] for f in flips_list[1:]],rtol=1e-4 if precision=='single' else 1e-7)
+        assert_allclose(cg.pop_many(pad_flips(flips_list)),pratios)
+
+def test_diag_cache():
+    print 'Testing diagonal energy cache.'
+    nsite=8
+    i,j=triu_indices(nsite,1)
+    h=BondH(nsite,array([i,j]).T,J=0,Jz=random.random(len(i))-0.5)   #long range Ising
+    for nflip,op in [(1,h),(2,h),(2,HeisenbergH(nsite))]:
+        rbm=random_rbm(nin=nsite,nhid=8,group=TIGroup([nsite]))
+        cg=RBMConfigGenerator(nflip=nflip,initial_config=[1,-1,1,-1,-1,1,1,-1],diag_op=op)
+        cg.set_state(rbm)
+        for k in xrange(100):
+            flips,pratio=cg.fire()
+            cg.confirm(flips)
+            if k%30==0: cg.sweep(10)
+            bonds,Jz=op.get_diag_bonds()
+            assert_allclose(cg.ediag,(Jz*cg.config[bonds[:,0]]*cg.config[bonds[:,1]]).sum()/4.)
+        cg2=RBMConfigGenerator(nflip=nflip,initial_config=cg.config)
+        cg2.set_state(rbm)
+        assert_allclose(op._sandwich(cg),op._sandwich(cg2))
+
+def test_amplitude_cache():
+    print 'Testing amplitude cache.'
+    g=TIGroup([2,4])
+    config=array([1,-1,1,-1,-1,1,1,-1])
+    keys=pack_configs(g.apply_all(config),g.apply_all(arange(8)))
+    assert_(all(keys==keys[0]))
+    assert_(any(pack_configs(g.apply_all(config))!=keys[0]))
+    for dtype in ['complex128','float64']:
+        rbm=random_rbm(nin=8,nhid=8,group=g,dtype=dtype)
+        cg=RBMConfigGenerator(nflip=2,initial_config=config,cache_size=20)
+        cg.set_state(rbm)
+        cg0=RBMConfigGenerator(nflip=2,initial_config=cg.config)
+        cg0.set_state(rbm)
+        h=HeisenbergH2D(2,4)
+        for k in xrange(50):
+            assert_allclose(h._sandwich(cg),h._sandwich(cg0))
+            flips,pratio=cg.fire()
+            cg.confirm(flips)
+            cg0.config[...]=cg.config; cg0.set_state(rbm)
+        assert_(cg.cache_hits>0 and cg.cache_misses>0 and len(cg._cache)<=20)
+        #new parameters invalidate the cache, the next lookups all miss.
+        rbm.W*=2
+        cg.set_state(rbm); cg0.set_state(rbm)
+        assert_(len(cg._cache)==0)
+        hits,misses=cg.cache_hits,cg.cache_misses
+        assert_allclose(h._sandwich(cg),h._sandwich(cg0))
+        assert_(cg.cache_hits==hits and cg.cache_misses>misses)
+        #the same config is then served from the cache.
+        assert_allclose(h._sandwich(cg),h._sandwich(cg0))
+        assert_(cg.cache_hits>hits)
+
+if __name__=='__main__':
+    test_pop_group()
+    test_single_precision()
+    test_site_lists()
+    test_pop_many()
+    test_diag_cache()
+    test_amplitude_cache()
@@ -0,0 +1,54 @@
+from numpy import *
+from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
+from scipy.linalg import solve,pinv
+from scipy.sparse.linalg import aslinearoperator
+import sys,pdb,time
+sys.path.insert(0,'../')
+
+from linsolve import *
+
+def random_hermitian(n,neg=0):
+    random.seed(2)
+    U=linalg.qr(random.random((n,n))+1j*random.random((n,n)))[0]
+    L=exp(random.uniform(-3,1,n))
+    L[:neg]*=-1
+    S=(U*L).dot(U.T.conj())
+    return (S+S.T.conj())/2
+
+def test_solvers():
+    print 'Test solvers for positive definite systems.'
+    S=random_hermitian(50)
+    F=random.random(50)+1j*random.random(50)
+    x0=solve(S,F)
+    for solver in [CholSolver(),CholSolver('ldl'),EighSolver(),IterSolver('cg',tol=1e-12),IterSolver('minres',tol=1e-12),IterSolver('cg',tol=1e-12,precond='eig')]:
+        assert_allclose(solver(S,F),x0,atol=1e-8)
+        assert_(len(solver.timings)==1)
+    assert_allclose(IdentitySolver()(S,F),F)
+
+    print 'Test indefinite and singular systems.'
+    S2=random_hermitian(50,neg=5)
+    assert_allclose(CholSolver()(S2,F),solve(S2,F),atol=1e-8)
+    S3=S.copy(); S3[:,0]=S3[0]=0
+    assert_allclose(EighSolver()(S3,F),pinv(S3).dot(F),atol=1e-8)
+
+def test_precond():
+    print 'Test reuse of eigenbasis as preconditioner.'
+    S=random_hermitian(100)
+    F=random.random(100)
+    niters=[]
+    for precond in [None,'eig']:
+        solver=IterSolver('cg',tol=1e-10,precond=precond)
+        solver(S,F)
+        solver._x=None  #no warm start.
+        solver(S+1e-2*random_hermitian(100),F)
+        niters.append(solver.niters[-1])
+    print 'Number of iterations without/with preconditioner: %s'%niters
+    assert_(niters[1]<niters[0])
+    #matrix-free S.
+    solver=IterSolver('cg',tol=1e-10,precond='eig')
+    assert_allclose(solver(aslinearoperator(S),F),solve(S,F),atol=1e-6)
+    assert_(solver.niters[-1]<niters[0])
+
+if __name__=='__main__':
+    test_solvers()
+    test_precond()
@@ -1,7 +1,7 @@
 from numpy import *
 from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
 from scipy.sparse.linalg import LinearOperator
-from scipy.linalg import kron
+from scipy.linalg import kron,norm
 from matplotlib.pyplot import *
 import sys,pdb,time
 from os import path
@@ -59,6 +59,50 @@ def test_model2():
         v_true=v0.dot(H)
         assert_allclose(vec,v_true)
 
+def test_bondh():
+    J1,J2=1.,0.5
+    nsite=6
+    scfg=SpinSpaceConfig([nsite,2])
+    config=array([1,1,0,0,1,0])
+    bonds=concatenate([chain_bonds(nsite),chain_bonds(nsite,dist=2)])
+    h=BondH(nsite,bonds,J=concatenate([J1*ones(nsite),J2*ones(nsite)]))
+    H=FakeVMC(h).get_H()
+    print 'Testing rmatmul of J1-J2 Hamiltonian.'
+    wl,flips=h._rmatmul(1-2*config)
+    configs=[]
+    for flip in flips:
+        nc=copy(1-2*config)
+        nc[asarray(flip)]*=-1
+        configs.append(nc)
+    ss=SparseState(wl,configs)
+    vec=ss.tovec(scfg)
+    v0=zeros(scfg.hndim); v0[scfg.config2ind(config)]=1
+    assert_allclose(vec,v0.dot(H))
+    #compare with HeisenbergH2D
+    for periodic in [True,False]:
+        h1,h2=HeisenbergH2D(2,3,J=-3.,Jz=2,periodic=periodic),BondH(6,square_bonds(2,3,periodic=periodic),J=-3.,Jz=2)
+        assert_allclose(FakeVMC(h1).get_H(),FakeVMC(h2).get_H())
+
+def test_fakevmc():
+    print 'Testing exact expectations streamed over chunks of basis states.'
+    from linop import PartialW,OpQueue
+    from group import TIGroup
+    nsite=6
+    for h in [HeisenbergH(nsite=nsite),BondH(nsite,concatenate([chain_bonds(nsite),chain_bonds(nsite,dist=2)]),J=1.,Jz=0.5),TFI(nsite,Jz=-1,h=-0.7)]:
+        rbm=random_rbm(nin=nsite,nhid=2*nsite,group=TIGroup(nsite))
+        rbm.W*=30
+        fv=FakeVMC(h)
+        v=rbm.tovec(fv.scfg)
+        if fv.sz0: v=fv.project_vec(v,0)
+        v/=norm(v)
+        assert_allclose(fv.measure(h,rbm),v.conj().dot(fv.get_H()).dot(v),atol=1e-12)
+        q=OpQueue((PartialW(),h),(lambda a,b:a[:,newaxis].conj()*a,lambda a,b:a.conj()*b))
+        #a small memory budget splits the basis into many chunks.
+        for o1,o2 in zip(fv.measure(q,rbm),FakeVMC(h,mem=2**12).measure(q,rbm)):
+            assert_allclose(o1,o2,atol=1e-12)
+
 if __name__=='__main__':
     test_model1()
     test_model2()
+    test_bondh()
+    test_fakevmc()
@@ -3,7 +3,7 @@ Test Stochastic Reconfiguration with minimal model.
 '''
 from numpy import *
 from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_allclose
-from scipy.linalg import kron,eigh,norm
+from scipy.linalg import kron,eigh,norm,solve
 from matplotlib.pyplot import *
 import sys,pdb,time
 from os import path
@@ -115,6 +115,88 @@ class SRTest(object):
         savetxt(fname,el)
         assert_(err<0.05)
 
+    def test_sample_matrix(self):
+        print 'Testing S and F from sample matrix.'
+        group=TIGroup(self.nsite if not isinstance(self.h,HeisenbergH2D) else 2*[int(sqrt(self.nsite))])
+        self.rbm=random_rbm(nin=self.nsite,nhid=self.nsite,group=group)
+        SFs=[]
+        for nsample_block in [None,100]:
+            random.seed(5)
+            sr=SR(self.h,self.rbm,handler=self.vmc,nsample_block=nsample_block)
+            SFs.append(sr.measure_SF())
+        assert_allclose(SFs[0][0],SFs[1][0],atol=1e-12)
+        assert_allclose(SFs[0][1],SFs[1][1],atol=1e-12)
+
+    def test_matrix_free(self):
+        print 'Testing matrix-free SR solvers.'
+        group=TIGroup(self.nsite if not isinstance(self.h,HeisenbergH2D) else 2*[int(sqrt(self.nsite))])
+        self.rbm=random_rbm(nin=self.nsite,nhid=self.nsite,group=group)
+        arr=self.rbm.dump_arr()
+        gs=[]
+        for reg_params in [('delta',{'lambda0':1e-2}),('cg',{'lambda0':1e-2,'tol':1e-10}),('minres',{'lambda0':1e-2,'tol':1e-10})]:
+            random.seed(5)
+            sr=SR(self.h,self.rbm,handler=self.vmc,reg_params=reg_params)
+            gs.append(sr.compute_gradient(arr))
+        assert_allclose(gs[1],gs[0],atol=1e-8)
+        assert_allclose(gs[2],gs[0],atol=1e-8)
+
+    def test_sample_space(self):
+        print 'Testing sample space SR.'
+        self.rbm=random_rbm(nin=self.nsite,nhid=4*self.nsite)
+        arr=self.rbm.dump_arr()
+        for reg_params in [('delta',{'lambda0':1e-2}),('carleo',{}),('trunc',{'lambda0':0.2,'eps_trunc':1e-12})]:
+            gs=[]
+            for sample_space in [False,True]:
+                random.seed(5)
+                cgen=RBMConfigGenerator(initial_config=[-1,1]*(self.nsite/2)+[1]*(self.nsite%2),nflip=self.vmc.cgen.nflip)
+                vmc=VMC(cgen,nbath=500*self.nsite,nsample=20*self.nsite,nmeasure=self.nsite)   #fewer samples than parameters.
+                sr=SR(self.h,self.rbm,handler=vmc,reg_params=reg_params,nsample_block=100,sample_space=sample_space)
+                gs.append(sr.compute_gradient(arr))
+            assert_allclose(gs[1],gs[0],atol=1e-10)
+
+    def test_block(self):
+        print 'Testing block diagonal SR.'
+        self.rbm=random_rbm(nin=self.nsite,nhid=2*self.nsite)
+        arr=self.rbm.dump_arr()
+        def get_vmc():
+            random.seed(5)
+            cgen=RBMConfigGenerator(initial_config=[-1,1]*(self.nsite/2)+[1]*(self.nsite%2),nflip=self.vmc.cgen.nflip)
+            return VMC(cgen,nbath=500*self.nsite,nsample=1000*self.nsite,nmeasure=self.nsite)
+        S,F=SR(self.h,self.rbm,handler=get_vmc(),nsample_block=100).measure_SF()
+        assert_raises(TypeError,SR,self.h,self.rbm,handler=self.fv,reg_params=('block',{}))
+        for reg_params in [('block',{'by':'var'}),('block',{'by':'hidden'}),('diag',{})]:
+            sr=SR(self.h,self.rbm,handler=get_vmc(),reg_params=reg_params)
+            g=sr.compute_gradient(arr)
+            blocks=[[i] for i in xrange(len(arr))] if reg_params[0]=='diag' else self.rbm.get_param_blocks(**reg_params[1])
+            assert_(sorted(concatenate(blocks))==range(len(arr)))
+            g0=zeros_like(F)
+            for inds in blocks:
+                g0[inds]=solve(S[ix_(inds,inds)]+1e-4*identity(len(inds)),F[inds])
+            assert_allclose(g,g0,atol=1e-8)
+
+    def test_line_search(self):
+        print 'Testing correlated sampling line search.'
+        random.seed(5)
+        self.rbm=random_rbm(nin=self.nsite,nhid=2*self.nsite)
+        arr=self.rbm.dump_arr()
+        cgen=RBMConfigGenerator(initial_config=[-1,1]*(self.nsite/2)+[1]*(self.nsite%2),nflip=self.vmc.cgen.nflip)
+        vmc=VMC(cgen,nbath=500*self.nsite,nsample=5000*self.nsite,nmeasure=self.nsite,keep_configs=True)
+        sr=SR(self.h,self.rbm,handler=vmc,reg_params=('delta',{'lambda0':1e-2}))
+        ds=sr.compute_gradient(arr)
+        #steps of fixed length in parameter space.
+        steps=array([0,0.02,0.05])/norm(ds)
+        t,el=sr.line_search(arr,ds,steps=steps)
+        print 'Energies along the SR direction: %s'%el
+        assert_allclose(el[0],sr._opq_vals[1].real,atol=1e-8)
+        assert_(isfinite(el[1]))
+        for ti,ei in zip(steps,el):
+            if not isfinite(ei): continue
+            self.rbm.load_arr(arr-ti*ds)
+            assert_allclose(ei,self.fv.measure(self.h,self.rbm).real,rtol=0.05)
+        assert_(el[1]<el[0])
+        assert_raises(TypeError,SR(self.h,self.rbm,handler=self.fv).line_search,arr,ds)
+        assert_allclose(exp(self.rbm.get_lnweight(vmc.configs[:3])),[self.rbm.get_weight(c) for c in vmc.configs[:3]],rtol=1e-8)
+
 def show_err_sr(nsite):
     from matplotlib.pyplot import plot,ion
     ion()
@@ -3,7 +3,7 @@ from numpy.testing import dec,assert_,assert_raises,assert_almost_equal,assert_a
 from scipy.sparse.linalg import LinearOperator
 from scipy.linalg import kron,norm
 from matplotlib.pyplot import *
-import sys,pdb,time
+import sys,pdb,time,copy
 from os import path
 sys.path.insert(0,'../')
 
@@ -62,6 +62,137 @@ class VMCTest(object):
             #analyse_sampling(self.vmc._config_histo,rbm)
             assert_(err<0.1)
 
+    def test_measureh_batch(self):
+        print 'Batched VMC measurements on HeisenbergH.'
+        cgen=BatchRBMConfigGenerator(nwalkers=50,nflip=2,initial_config=array([-1,1]*2),diag_op=self.h)
+        vmc=VMC(cgen,nbath=100*self.nsite,nsample=50000*self.nsite,nmeasure=self.nsite,sampling_method='metropolis')
+        for rbm in [self.rbm,self.rbm_g]:
+            O_true=self.fv.measure(self.h,rbm)/self.nsite
+            O_vmc=vmc.measure(self.h,rbm)/self.nsite
+
+            err=abs(O_vmc-O_true)
+            print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+            assert_(err<0.1)
+            #walker views track the diagonal energy of current configs.
+            walker=cgen.walker(1)
+            cg=RBMConfigGenerator(nflip=2,initial_config=walker.config.copy(),diag_op=self.h)
+            cg.set_state(rbm)
+            assert_allclose(walker.ediag,cg.ediag)
+            assert_allclose(c_sandwich(self.h,walker),c_sandwich(self.h,cg))
+
+        #a walker with no down spin has no valid pair to exchange.
+        cgen=BatchRBMConfigGenerator(nwalkers=2,nflip=2,initial_config=array([[1]*4,[-1,1]*2]))
+        cgen.set_state(self.rbm)
+        flips,pratio=cgen.fire()
+        assert_(pratio[0]==0 and pratio[1]>0)
+
+    def test_measureh_sweep(self):
+        print 'VMC measurements on HeisenbergH with compiled sweeps.'
+        cgen=RBMConfigGenerator(nflip=2,initial_config=array([-1,1]*2))
+        vmc=VMC(cgen,nbath=5000*self.nsite,nsample=50000*self.nsite,nmeasure=self.nsite,sampling_method='metropolis',use_sweep=True)
+        for rbm in [self.rbm,self.rbm_g]:
+            O_true=self.fv.measure(self.h,rbm)/self.nsite
+            O_vmc=vmc.measure(self.h,rbm)/self.nsite
+
+            err=abs(O_vmc-O_true)
+            print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+            assert_(err<0.1)
+
+    def test_measureh_parallel(self):
+        print 'Parallel VMC measurements on HeisenbergH.'
+        #single precision parameters in shared memory.
+        rbm_s=random_rbm(nin=self.nsite,nhid=self.nsite,dtype='float64')
+        rbm_s.a,rbm_s.b,rbm_s.W=[x.astype('float32') for x in [rbm_s.a,rbm_s.b,rbm_s.W]]
+        with ParallelVMC(self.vmc,nworker=4) as pvmc:
+            for rbm in [self.rbm,self.rbm_g,rbm_s]:
+                O_true=self.fv.measure(self.h,rbm)/self.nsite
+                O_vmc=pvmc.measure(self.h,rbm)/self.nsite
+
+                err=abs(O_vmc-O_true)
+                print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+                assert_(err<0.1)
+
+            #alternating operators seen by workers does not re-fork the pool.
+            h2=copy.copy(self.h)
+            pvmc.measure(h2,rbm_s)
+            pool=pvmc._pool
+            for op in [self.h,h2,self.h]:
+                O_true=self.fv.measure(op,rbm_s)/self.nsite
+                O_vmc=pvmc.measure(op,rbm_s)/self.nsite
+                assert_(abs(O_vmc-O_true)<0.1)
+            assert_(pvmc._pool is pool)
+        assert_(pvmc._pool is None)
+
+    def test_measureh_tol(self):
+        print 'VMC measurements on HeisenbergH with early stopping.'
+        tol=0.01*self.nsite
+        for use_sweep in [False,True]:
+            vmc=VMC(RBMConfigGenerator(nflip=2,initial_config=array([-1,1]*2)),nbath=5000*self.nsite,nsample=50000*self.nsite,
+                    nmeasure=self.nsite,sampling_method='metropolis',use_sweep=use_sweep)
+            bins=vmc.measure_bins(self.h,self.rbm,tol=tol)
+            O_true=self.fv.measure(self.h,self.rbm)/self.nsite
+            O_vmc=bins[0].mean()/self.nsite
+            print 'E/site = %s (%s), nbin = %s, Std Err = %s'%(O_vmc,O_true,bins[0].nbin,bins[0].std_err())
+            assert_(bins[0].std_err()<=tol and bins[0].nbin<vmc.nbin)
+            assert_(abs(O_vmc-O_true)<0.1)
+
+    def test_measureh_auto(self):
+        print 'VMC measurements on HeisenbergH with automatic warm-up and measurement stride.'
+        for cgen in [RBMConfigGenerator(nflip=2,initial_config=array([-1,1]*2)),BatchRBMConfigGenerator(nwalkers=50,nflip=2,initial_config=array([-1,1]*2))]:
+            vmc=VMC(cgen,nbath='auto',nsample=50000*self.nsite,nmeasure='auto',sampling_method='auto')
+            for rbm in [self.rbm,self.rbm_g]:
+                O_true=self.fv.measure(self.h,rbm)/self.nsite
+                O_vmc=vmc.measure(self.h,rbm)/self.nsite
+
+                err=abs(O_vmc-O_true)
+                print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+                assert_(err<0.1)
+            #tuned once, the second measurement uses the cached result.
+            assert_(vmc._ntuned==2)
+        #a numeric nbath skips the equilibration test.
+        vmc=VMC(RBMConfigGenerator(nflip=2,initial_config=array([-1,1]*2)),nbath=100,nsample=1000*self.nsite,nmeasure='auto')
+        vmc.measure(self.h,self.rbm)
+        assert_(vmc.tuned[0]==100+10*20*self.nsite)
+
+    def test_measureh_reuse(self):
+        print 'VMC measurements on HeisenbergH reusing samples of the last measurement.'
+        rbm=copy.deepcopy(self.rbm)
+        v=rbm.dump_arr()
+        for cgen in [RBMConfigGenerator(nflip=2,initial_config=array([-1,1]*2)),BatchRBMConfigGenerator(nwalkers=50,nflip=2,initial_config=array([-1,1]*2))]:
+            vmc=VMC(cgen,nbath=5000*self.nsite,nsample=50000*self.nsite,nmeasure=self.nsite,reuse_ess=0.8)
+            #small updates reuse samples, a large one resamples.
+            for dv,nreuse in [(0,0),(1e-2,1),(2e-2,2),(10.,0)]:
+                rbm.load_arr(v+dv*random.random(len(v)))
+                O_true=self.fv.measure(self.h,rbm)/self.nsite
+                O_vmc=vmc.measure(self.h,rbm)/self.nsite
+                err=abs(O_vmc-O_true)
+                print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+                assert_(err<0.1)
+                assert_(vmc._nreuse==nreuse)
+                #the buffer keeps the samples of full measurements only.
+                assert_(len(vmc._buffers)==1)
+                if nreuse==0: configs=vmc._buffers.values()[0][0]
+                assert_(vmc._buffers.values()[0][0] is configs)
+
+    def test_measureh_exact(self):
+        print 'Exact sampling measurements on HeisenbergH.'
+        H=self.fv.get_H()
+        for sz0 in [False,True]:
+            vmc=ExactSampler(RBMConfigGenerator(nflip=2),nsample=10000*self.nsite,sz0=sz0)
+            for rbm in [self.rbm,self.rbm_g]:
+                if sz0:
+                    O_true=self.fv.measure(self.h,rbm)/self.nsite
+                else:
+                    v=rbm.tovec(self.fv.scfg); v/=norm(v)
+                    O_true=v.conj().dot(H).dot(v)/self.nsite
+                O_vmc=vmc.measure(self.h,rbm)/self.nsite
+                err=abs(O_vmc-O_true)
+                print 'E/site = %s (%s), Error/site = %s'%(O_vmc,O_true,err)
+                assert_(err<0.02)
+        #the cached basis follows sz0.
+        vmc.sz0=False
+        assert_(len(vmc.get_basis(self.nsite))==2**self.nsite)
+
     def test_measurepw(self):
         print 'VMC measurements on PartialW.'
         #construct operator pw act on config
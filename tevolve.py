@@ -3,15 +3,16 @@ Stochestic Reconfiguration.
 '''
 
 from numpy import *
-from scipy.linalg import pinv,inv,norm,eigh
+from scipy.linalg import norm
 import pdb
 
 from linop import PartialW,OpQueue
+from linsolve import EighSolver
 from optimizer import DefaultOpt
 
 __all__=['tevolve']
 
-def tevolve(H,rbm,handler,niter=200,optimizer=DefaultOpt(0.1),reg_params=('delta',{})):
+def tevolve(H,rbm,handler,niter=200,optimizer=DefaultOpt(0.1),reg_params=('delta',{}),solver=None):
     '''
     Stochestic Reconfiguration.
 
@@ -27,8 +28,10 @@ def tevolve(H,rbm,handler,niter=200,optimizer=DefaultOpt(0.1),reg_params=('delta
             * 'trunc' -> carleo's approach S_{kk}*(1+lambda0), diacarding near singular values (s/s_max < eps_trunc).
             * 'pinv'  -> use pseudo inverse instead.
             * 'identity' -> equivalence to SD.
+        :solver: <LinSolver>/None, solver for S x = F, pseudo inverse by <EighSolver> by default.
     '''
     reg_method,reg_var=reg_params
+    if solver is None: solver=EighSolver()
     q=OpQueue((PartialW(),H),(lambda a,b:a[...,newaxis].conj()*a,lambda a,b:a.conj()*b))
     nb=rbm.nhid/rbm.group.ng
     info={}
@@ -40,11 +43,9 @@ def tevolve(H,rbm,handler,niter=200,optimizer=DefaultOpt(0.1),reg_params=('delta
         S=OPW2-OPW[:,newaxis].conj()*OPW
         F=OPWH-OPW.conj()*OH
 
-        #regularize S matrix to get Sinv.
-        Sinv=pinv(S)
         #g=gamma if not hasattr(gamma,'__call__') else gamma(p)
-        #ds=g*Sinv.dot(F)
-        ds=optimizer(OH,Sinv.dot(F),p)  #decide the move according to the gradient
+        #ds=g*solver(S,F)
+        ds=optimizer(OH,solver(S,F),p)  #decide the move according to the gradient
         rbm.a+=ds[:rbm.nin]
         rbm.b+=ds[rbm.nin:rbm.nin+nb]
         rbm.W+=ds[rbm.nin+nb:].reshape(rbm.W.shape)
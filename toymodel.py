@@ -8,9 +8,9 @@ import pdb
 
 from tba.hgen import SpinSpaceConfig,sx,sy,sz
 from linop import *
-from utils import logfh_prime
+from utils import logfh_prime,ind2config,get_basis
 
-__all__=['TFI','HeisenbergH','FakeVMC','HeisenbergH2D']
+__all__=['TFI','HeisenbergH','FakeVMC','HeisenbergH2D','BondH','chain_bonds','square_bonds']
 
 class TFI(LinOp):
     '''
@@ -45,105 +45,144 @@ class TFI(LinOp):
                 flips.append(array([i],dtype='int64'))
         return wl,flips
 
+    def get_diag_bonds(self):
+        '''Bonds and Jz couplings of the Sz*Sz terms.'''
+        bonds=chain_bonds(self.nsite,periodic=self.periodic)
+        return bonds,self.Jz*ones(len(bonds))
+
+    def get_offdiag_terms(self):
+        '''
+        Spin flip terms.
+
+        Return:
+            tuple, (flips, coeffs, exchange), flipped sites of shape (nterm,nf), coefficients and whether a term needs antiparallel spins.
+        '''
+        return arange(self.nsite)[:,newaxis],self.h/2.*ones(self.nsite),False
+
     def _sandwich(self,cgen,**kwargs):
-        wl,flips=self._rmatmul(cgen.config)
-        return sum(wl*[cgen.pop(flip)[-1] for flip in flips])
+        if getattr(cgen,'diag_op',None) is self:
+            ediag=cgen.ediag
+        else:
+            c=cgen.config
+            nn_par=roll(c,-1)*c
+            if not self.periodic: nn_par=nn_par[:-1]
+            ediag=self.Jz/4.*nn_par.sum()
+        return ediag+self.h/2.*cgen.pop_many(arange(len(cgen.config))[:,newaxis]).sum()
 
-class HeisenbergH(LinOp):
+def chain_bonds(nsite,dist=1,periodic=True):
     '''
-    Heisenberg Hamiltonian
+    Bonds of a chain.
 
-    H = J S_z*S_z' + J/2(S+S-' + S-S+')
+    Parameters:
+        :nsite: int,
+        :dist: int, distance between two sites of a bond, 1 for nearest neighbor and 2 for next nearest neighbor.
+        :periodic: bool,
+
+    Return:
+        2darray, site pairs of shape (nbond,2).
+    '''
+    i=arange(nsite if periodic else nsite-dist)
+    return array([i,(i+dist)%nsite],dtype='int32').T
+
+def square_bonds(N1,N2,periodic=True):
+    '''
+    Nearest neighbor bonds of a square lattice, site (i1,i2) is indexed by i1*N2+i2.
+
+    Parameters:
+        :N1,N2: int, the size of lattice.
+        :periodic: bool,
+
+    Return:
+        2darray, site pairs of shape (nbond,2), bonds in the 1st direction come first.
+    '''
+    i1,i2=meshgrid(arange(N1),arange(N2),indexing='ij')
+    bonds=[]
+    for j1,j2,mask in [(i1+1,i2,i1<N1-1),(i1,i2+1,i2<N2-1)]:
+        if periodic: mask=ones_like(mask)
+        bonds.append(array([(i1*N2+i2)[mask],((j1%N1)*N2+j2%N2)[mask]],dtype='int32').T)
+    return concatenate(bonds,axis=0)
+
+class BondH(LinOp):
+    '''
+    Heisenberg Hamiltonian defined on a bond list, e.g. J1-J2 chains, ladders or Kagome lattices.
+
+    H = sum_b Jz_b S_z*S_z' + J_b/2(S+S-' + S-S+')
+
+    Attributes:
+        :nsite: int,
+        :bonds: 2darray, site pairs of shape (nbond,2).
+        :J,Jz: number/1darray, couplings, or couplings on each bond.
     '''
     opt_lmul=False
 
-    def __init__(self,nsite,J=1.,Jz=None,periodic=True):
+    def __init__(self,nsite,bonds,J=1.,Jz=None):
         self.J=J
         self.Jz=J if Jz is None else Jz
         self.nsite=nsite
-        self.periodic=periodic
+        self.bonds=asarray(bonds,dtype='int32').reshape([-1,2])
+        #precompiled bond tables.
+        self._bi,self._bj=self.bonds[:,0].copy(),self.bonds[:,1].copy()
+        self._J=self.J*ones(len(self.bonds))
+        self._Jz=self.Jz*ones(len(self.bonds))
+        #bonds with flip terms.
+        self._xy=where(self._J!=0)[0]
+        self._xbonds,self._xJ=self.bonds[self._xy],self._J[self._xy]
+        self._xi,self._xj=self._bi[self._xy],self._bj[self._xy]
+
+    def get_diag_bonds(self):
+        '''Bonds and Jz couplings of the Sz*Sz terms.'''
+        return self.bonds,self._Jz
+
+    def get_offdiag_terms(self):
+        '''Spin flip terms, see `TFI.get_offdiag_terms`.'''
+        return self._xbonds,self._xJ/2.,True
 
     def _rmatmul(self,config):
         if hasattr(config,'__iter__'):  #series of {1,-1}
             ws,cs=[1],[asarray(config)]
         else:
             ws,cs=config.w,config.configs
-        nsite=len(cs[0])
         wl,flips=[],[]
         for w,c in zip(ws,cs):
             #J(SzSz) terms.
-            nn_par=roll(c,-1)*c
-            if not self.periodic: nn_par=nn_par[:-1]
-            wl.append(self.Jz/4.*w*(nn_par).sum(axis=-1))
+            nn_par=c[self._bi]*c[self._bj]
+            wl.append(w/4.*(self._Jz*nn_par).sum())
             flips.append(array([],dtype='int64'))
 
             mask=nn_par!=1
-            i=where(mask)[0]
-            j=(i+1)%nsite
-
-            wl+=[self.J/2.*w]*len(i)
-            flips+=zip(i,j)
-
+            wl+=list(w/2.*self._J[mask])
+            flips+=list(self.bonds[mask])
         return wl,flips
 
     def _sandwich(self,cgen,**kwargs):
-        wl,flips=self._rmatmul(cgen.config)
-        return sum(asarray(wl)*[cgen.pop(flip)[-1] for flip in flips])
+        c=cgen.config
+        if getattr(cgen,'diag_op',None) is self:
+            ediag=cgen.ediag
+        else:
+            ediag=(self._Jz*c[self._bi]*c[self._bj]).sum()/4.
+        mask=c[self._xi]!=c[self._xj]
+        return ediag+(self._xJ[mask]*cgen.pop_many(self._xbonds[mask])).sum()/2.
 
-class HeisenbergH2D(LinOp):
+class HeisenbergH(BondH):
     '''
-    Heisenberg Hamiltonian, 2D version.
+    Heisenberg Hamiltonian
 
     H = J S_z*S_z' + J/2(S+S-' + S-S+')
     '''
-    opt_lmul=False
+    def __init__(self,nsite,J=1.,Jz=None,periodic=True):
+        self.periodic=periodic
+        super(HeisenbergH,self).__init__(nsite,chain_bonds(nsite,periodic=periodic),J=J,Jz=Jz)
+
+class HeisenbergH2D(BondH):
+    '''
+    Heisenberg Hamiltonian, 2D version.
 
+    H = J S_z*S_z' + J/2(S+S-' + S-S+')
+    '''
     def __init__(self,N1,N2,J=1.,Jz=None,periodic=True):
-        self.J=J
-        self.Jz=J if Jz is None else Jz
         self.periodic=periodic
         self.N1,self.N2=N1,N2
-
-    @property
-    def nsite(self):
-        return self.N1*self.N2
-
-    def _rmatmul(self,config):
-        N1,N2=self.N1,self.N2
-        config2d=config.reshape([N1,N2])
-        wl,flips=[],[]
-        #J(SzSz) terms.
-        nn_par1=roll(config2d,-1,axis=0)*config2d
-        nn_par2=roll(config2d,-1,axis=1)*config2d
-        if not self.periodic:
-            nn_par1=nn_par1[:-1,:]
-            nn_par2=nn_par2[:,:-1]
-        wl.append(self.Jz/4.*(nn_par1.sum()+nn_par2.sum()))
-        flips.append(array([],dtype='int64'))
-        #return wl,flips
-
-        #bond in 1st direction
-        mask1=nn_par1!=1
-        i1,i2=where(mask1)
-        j1,j2=(i1+1)%N1,i2
-        i=i1*N2+i2
-        j=j1*N2+j2
-        wl+=[self.J/2.]*len(i)
-        flips+=zip(i,j)
-
-        #bond in 2nd direction
-        mask2=nn_par2!=1
-        i1,i2=where(mask2)
-        j1,j2=i1,(i2+1)%N2
-        i=i1*N2+i2
-        j=j1*N2+j2
-        wl+=[self.J/2.]*len(i)
-        flips+=zip(i,j)
-        return wl,flips
-
-    def _sandwich(self,cgen,**kwargs):
-        wl,flips=self._rmatmul(cgen.config)
-        return sum(asarray(wl)*[cgen.pop(flip)[-1] for flip in flips])
+        super(HeisenbergH2D,self).__init__(N1*N2,square_bonds(N1,N2,periodic=periodic),J=J,Jz=Jz)
 
     def visualize(self,config,**kwargs):
         from matplotlib.pyplot import pcolor
@@ -154,14 +193,24 @@ class HeisenbergH2D(LinOp):
         axis('off')
 
 class FakeVMC(object):
-    '''The Fake VMC program'''
-    def __init__(self,h):
+    '''
+    The Fake VMC program, expectation values are evaluated exactly.
+
+    Attributes:
+        :h: <BondH>/<TFI>, the model.
+        :mem: int, memory budget (in bytes) of temporary arrays in a chunk of basis states.
+        :nchunk: int, number of basis states in a chunk when no parameter derivative is measured.
+        :sz0: bool, work in the Sz=0 sector, True for <BondH> models.
+    '''
+    def __init__(self,h,mem=2**27,nchunk=4096):
         self.h=h
+        self.mem,self.nchunk=mem,nchunk
+        self.sz0=isinstance(h,BondH)
         self.scfg=scfg=SpinSpaceConfig([h.nsite,2])
 
     def get_H(self):
         '''Get the target Hamiltonian Matrix.'''
-        nsite,periodic=self.h.nsite,self.h.periodic
+        nsite,periodic=self.h.nsite,getattr(self.h,'periodic',False)
         scfg=SpinSpaceConfig([nsite,2])
         if isinstance(self.h,TFI):
             Jz,h=self.h.Jz,self.h.h
@@ -206,6 +255,13 @@ class FakeVMC(object):
             #e,v=eigsh(H,k=1,which='SA')
             #print e/lattice.nsite
             return H
+        elif isinstance(self.h,BondH):
+            H=0
+            for (i,j),J,Jz in zip(self.h.bonds,self.h._J,self.h._Jz):
+                i,j=min(i,j),max(i,j)
+                for ss,Ji in zip([sx,sy,sz],[J,J,Jz]):
+                    H=H+Ji/4.*kron(kron(kron(kron(eye(2**i),ss),eye(2**(j-i-1))),ss),eye(2**(nsite-j-1)))
+            return H
 
     def project_vec(self,vec,m=0):
         '''Project vector to good quantum number'''
@@ -214,52 +270,90 @@ class FakeVMC(object):
         vec[sum(configs,axis=1)!=0]=0
         return vec
 
+    def get_probs(self,state):
+        '''
+        Log amplitudes and normalized probabilities of basis states.
+
+        Return:
+            tuple, (basis, lnpsi, p).
+        '''
+        basis=get_basis(state.nin,sz0=self.sz0,nchunk=self.nchunk)
+        lnpsi=concatenate([state.get_lnweight(ind2config(basis[i:i+self.nchunk],state.nin)) for i in xrange(0,len(basis),self.nchunk)])
+        p=exp(2*(lnpsi.real-lnpsi.real.max()))
+        return basis,lnpsi,p/p.sum()
+
+    def local_energy(self,h,basis,lnpsi,inds,configs):
+        '''
+        Local energies of a chunk of basis states, amplitudes of connected states are looked up from `lnpsi`.
+
+        Parameters:
+            :h: <BondH>/<TFI>, the Hamiltonian.
+            :basis,lnpsi: 1darray, indices and log amplitudes of all basis states.
+            :inds: 1darray, positions of the chunk in basis.
+            :configs: 2darray, configurations of the chunk.
+
+        Return:
+            1darray,
+        '''
+        nin=configs.shape[1]
+        bonds,Jz=h.get_diag_bonds()
+        el=(configs[:,bonds[:,0]]*configs[:,bonds[:,1]]).dot(Jz)/4.+0j
+        flips,coeffs,exchange=h.get_offdiag_terms()
+        for flip,coeff in zip(flips,coeffs):
+            if exchange:
+                mask=configs[:,flip[0]]!=configs[:,flip[1]]
+            else:
+                mask=slice(None)
+            ninds=basis[inds[mask]]^(1<<(nin-1-flip)).sum()
+            if self.sz0:
+                ninds=searchsorted(basis,ninds)
+            el[mask]+=coeff*exp(lnpsi[ninds]-lnpsi[inds[mask]])
+        return el
+
+    def get_pS(self,state,configs):
+        '''Local values of PartialW for a chunk of configurations.'''
+        nc=len(configs)
+        theta=state.feed_input(configs)
+        lfp=logfh_prime(theta).reshape([nc,state.group.ng,state.W.shape[1]])
+        configs_g=state.group.apply_all(configs).reshape([state.group.ng,nc,-1])
+        return concatenate([configs,lfp.sum(axis=1),einsum('gci,cgj->cij',configs_g,lfp).reshape([nc,-1])],axis=-1)
+
     def measure(self,op,state,initial_config=None,**kwargs):
-        '''Measure an operator through detailed calculation.'''
-        nsite=state.nin
-        H=self.get_H()
-        scfg=self.scfg
-        #prepair state
-        v=state.tovec(scfg)
-        if isinstance(self.h,(HeisenbergH,HeisenbergH2D)): v=self.project_vec(v,0)
-        v/=norm(v)
+        '''
+        Measure an operator through detailed calculation, streaming over chunks of basis states.
+        The Sz=0 sector is used for <BondH> models.
+        '''
+        H=op.op_base[1] if isinstance(op,OpQueue) else op
+        basis,lnpsi,p=self.get_probs(state)
+        if isinstance(op,(BondH,TFI)):
+            nchunk=self.nchunk
+        elif isinstance(op,(PartialW,OpQueue)):
+            #pS and the weighted pS in a chunk dominate the memory.
+            nparam=state.nin+len(state.b)+state.W.size
+            nchunk=max(1,int(self.mem/(32*nparam+16*state.nhid+4*state.nin)))
+        else:
+            raise TypeError()
 
-        if isinstance(op,(HeisenbergH,TFI,HeisenbergH2D)):
-            return v.conj().dot(H).dot(v)
+        OH,OPW,OPW2,OPWH=0,0,0,0
+        for i in xrange(0,len(basis),nchunk):
+            inds=arange(i,min(i+nchunk,len(basis)))
+            configs=ind2config(basis[inds],state.nin)
+            pi=p[inds]
+            if isinstance(op,(BondH,TFI,OpQueue)):
+                el=self.local_energy(H,basis,lnpsi,inds,configs)
+                OH=OH+pi.dot(el)
+            if isinstance(op,(PartialW,OpQueue)):
+                pS=self.get_pS(state,configs)
+                OPW=OPW+pi.dot(pS)
+            if isinstance(op,OpQueue):
+                pSp=pS.conj()*pi[:,newaxis]
+                if op.nop==4: OPW2=OPW2+pSp.T.dot(pS)
+                OPWH=OPWH+pSp.T.dot(el)
+        if isinstance(op,(BondH,TFI)):
+            return OH
         elif isinstance(op,PartialW):
-            configs=1-2*scfg.ind2config(arange(scfg.hndim))
-            pS=[]
-            pS.append(configs)
-            theta=state.feed_input(configs)
-            pS.append(logfh_prime(theta).reshape([len(configs),state.group.ng,len(state.b)]).sum(axis=1))
-            configs_g=state.group.apply_all(configs).swapaxes(0,1)
-            pS.append(sum(configs_g[:,:,:,newaxis]*logfh_prime(theta).reshape([scfg.hndim,state.group.ng,1,state.W.shape[1]]),axis=1).reshape([configs.shape[0],-1]))
-            pS=concatenate(pS,axis=-1)
-            return sum((v.conj()*v)[:,newaxis]*pS,axis=0)
-        elif isinstance(op,OpQueue):
-            #get H
-            OH=v.conj().dot(H).dot(v)
-
-            #get W
-            configs=1-2*scfg.ind2config(arange(scfg.hndim))
-            pS=[]
-            pS.append(configs)
-            theta=state.feed_input(configs)
-            pS.append(logfh_prime(theta).reshape([len(configs),state.group.ng,len(state.b)]).sum(axis=1))
-            configs_g=state.group.apply_all(configs).swapaxes(0,1)
-            pS.append(sum(configs_g[:,:,:,newaxis]*logfh_prime(theta).reshape([scfg.hndim,state.group.ng,1,state.W.shape[1]]),axis=1).reshape([configs.shape[0],-1]))
-            pS=concatenate(pS,axis=-1)
-            OPW=sum((v.conj()*v)[:,newaxis]*pS,axis=0)
-
-            OPW2=sum((v.conj()*v)[:,newaxis,newaxis]*(pS.conj()[:,:,newaxis]*pS[:,newaxis]),axis=0)
-            #OPWH=(v.conj()[:,newaxis,newaxis]*(pS.conj()[:,newaxis,:]*OH[:,:,newaxis])*v[newaxis,:,newaxis]).sum(axis=(0,1))
-            Hloc=zeros(v.shape,dtype='complex128')
-            Hloc[v!=0]=H.dot(v)[v!=0]/v[v!=0]
-            #Hloc=H.dot(v)/v
-            OPWH=(Hloc[:,newaxis]*pS.conj()*(v.conj()*v)[:,newaxis]).sum(axis=0)
-            if op.nop==4:
-                return OPW,OH,OPW2,OPWH
-            else:
-                return OPW,OH,OPWH
+            return OPW
+        elif op.nop==4:
+            return OPW,OH,OPW2,OPWH
         else:
-            raise TypeError()
+            return OPW,OH,OPWH
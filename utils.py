@@ -7,7 +7,7 @@ import pdb
 
 from setting import hyper_func
 
-__all__=['load_carleo_wf','log2cosh','log2sinh','logfh']
+__all__=['load_carleo_wf','log2cosh','log2sinh','logfh','ind2config','get_basis']
 
 def load_carleo_wf(filename,group=None):
     '''Load wavefunction of carleo's program.'''
@@ -78,3 +78,34 @@ elif hyper_func=='sinh':
 else:
     raise ValueError('undefined hyper function')
 
+def ind2config(inds,nin):
+    '''
+    Configurations of basis states, site 0 is the most significant bit and bit 1 means spin down.
+
+    Parameters:
+        :inds: 1darray, indices of basis states.
+        :nin: int, number of sites.
+
+    Return:
+        2darray, configurations of {1,-1} in rows.
+    '''
+    return 1-2*((asarray(inds)[:,newaxis]>>arange(nin-1,-1,-1))&1).astype('int32')
+
+def get_basis(nin,sz0=False,nchunk=4096):
+    '''
+    Indices of basis states.
+
+    Parameters:
+        :nin: int, number of sites.
+        :sz0: bool, keep states in the Sz=0 sector only.
+        :nchunk: int, number of states filtered in a chunk.
+
+    Return:
+        1darray, sorted indices.
+    '''
+    if not sz0: return arange(2**nin)
+    inds=[]
+    for i in xrange(0,2**nin,nchunk):
+        chunk=arange(i,min(i+nchunk,2**nin))
+        inds.append(chunk[ind2config(chunk,nin).sum(axis=1)==0])
+    return concatenate(inds)
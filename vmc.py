@@ -3,43 +3,187 @@ Variational Monte Carlo Kernel.
 '''
 
 from numpy import *
-import pdb
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import copy,pdb
 
 from linop import c_sandwich,OpQueue
 from binner import Bin
+from cgen import RBMConfigGenerator
+from clib import futils
+from utils import ind2config,get_basis
 
-__all__=['VMC']
+__all__=['VMC','ParallelVMC','ExactSampler','importance_weights']
+
+def importance_weights(lnpsi_new,lnpsi_old):
+    '''
+    Reweight samples of |psi_old|^2 to |psi_new|^2.
+
+    Parameters:
+        :lnpsi_new,lnpsi_old: 1darray, log amplitudes of sampled configurations.
+
+    Return:
+        tuple, (w, ess), normalized weights |psi_new/psi_old|^2 and the effective sample size 1/sum(w^2).
+    '''
+    lnw=2*(asarray(lnpsi_new)-asarray(lnpsi_old)).real
+    w=exp(lnw-lnw.max())
+    w/=w.sum()
+    return w,1./(w**2).sum()
 
 class VMC(object):
     '''
     Variational Monte Carlo Engine.
+
+    Attributes:
+        :nbath: int/'auto', number of warm-up proposals, 'auto' to detect equilibration (capped by nsample).
+        :nsample: int, number of samples, it is the upper cap if sampling stops early on `tol`.
+        :nmeasure: int/'auto', number of proposals between two measurements, 'auto' to decide it from the autocorrelation time.
+        :sampling_method: 'metropolis'/'heat-bath'/'auto', 'auto' to use heat-bath in warm-up and metropolis in measurements.
+        :nbin_min: int, the minimum number of bins before standard errors are trusted.
+        :bin_type: class, <Bin> or <StreamBin>, the latter keeps constant memory for large observables like the S matrix.
+        :status: 'WARM_UP'/'MEASURE'/None, the current stage of sampling.
+        :keep_configs: bool, keep the measured configurations of the last measurement in `configs` (2darray, one config in a row),
+            only the fresh ones if samples are reused.
+        :reuse_ess: float/None, reuse the configurations of the last full measurement if their effective sample size after reweighting
+            to the new state is above reuse_ess*(# of configurations), None to disable. The reused samples enter the bins with their
+            importance weights, counted as `ess` samples, and are topped up by a fresh chain started without warm-up from one of them drawn by weight,
+            so that the total effective number of samples stays at `nsample`. Buffers are kept for each (operator, state) pair and
+            only written by full measurements, the fresh samples of a reusing measurement are not kept. The state needs @get_lnweight,
+            bins need weighted `push` (<Bin>, <SampleBin>).
+        :max_reuse: int, the maximum number of consecutive measurements reusing samples, a full resampling is forced after it.
+        :nretune: int, with 'auto' nbath or nmeasure, `autotune` runs once every nretune measurements, the others use the cached result.
+        :tuned: tuple/None, (nbath, nmeasure) of the last `autotune`, set it to None to re-tune at the next measurement.
     '''
-    def __init__(self,cgen,nbath,nsample,nmeasure,nbin=50,sampling_method='metropolis',iprint=1):
+    def __init__(self,cgen,nbath,nsample,nmeasure,nbin=50,sampling_method='metropolis',iprint=1,use_sweep=False,nbin_min=10,bin_type=Bin,
+            keep_configs=False,reuse_ess=None,max_reuse=5,nretune=10):
         self.nbath,self.nsample=nbath,nsample
         self.cgen=cgen
         self.sampling_method=sampling_method
         self.nmeasure=nmeasure
         self.nbin=nbin
         self.iprint=iprint
+        self.use_sweep=use_sweep
+        self.nbin_min=nbin_min
+        self.bin_type=bin_type
+        self.status=None
+        self.keep_configs=keep_configs
+        self.configs=None
+        self.reuse_ess,self.max_reuse=reuse_ess,max_reuse
+        self._buffers={}    #(id(op), id(state)) -> [configs, log amplitudes, # of reuses] of the last full measurement.
+        self._nreuse=0      #number of consecutive reuses of the last measurement.
+        self._configs=None
+        self.nretune=nretune
+        self.tuned=None
+        self._ntuned=0      #number of measurements since the last autotune.
 
-    def accept(self,pratio,method='metropolis'):
+    def accept(self,pratio,method=None):
         '''
         Decide whether accept or reject a move.
 
         Parameters:
-            :pratio: float, the ratio of (distribution probability/transfer probability) between two configurations.
+            :pratio: float/1darray, the ratio of (distribution probability/transfer probability) between two configurations, 1darray for a batch of walkers.
+            :method: str/None, sampling method, default is `sampling_method`.
 
         Return:
-            bool, accept if True.
+            bool/1darray, accept if True.
         '''
-        if self.sampling_method=='auto':
+        if method is None: method=self.sampling_method
+        if method=='auto':
             method='heat-bath' if self.status=='WARM_UP' else 'metropolis'
-        if self.sampling_method=='metropolis':
+        if method=='metropolis':
             A=pratio
-        elif self.sampling_method=='heat-bath':
+        elif method=='heat-bath':
             A=pratio/(1+pratio)
+        if isinstance(A,ndarray):
+            return random.random(A.shape)<A
         return random.random()<A
 
+    def converged(self,bins,tol):
+        '''
+        Decide whether the standard errors of bins meet the tolerence.
+
+        Parameters:
+            :bins: list, <Bin> instances.
+            :tol: float/list, target standard error, or one for each bin, 0/None to skip a bin.
+
+        Return:
+            bool,
+        '''
+        if not hasattr(tol,'__iter__'): tol=[tol]*len(bins)
+        if not any(tol) or bins[0].nbin<max(2,self.nbin_min): return False
+        return all([abs(b.std_err()).max()<=t for b,t in zip(bins,tol) if t])
+
+    def advance(self,nstep):
+        '''
+        Perform Monte Carlo proposals without measurements.
+
+        Parameters:
+            :nstep: int, number of proposals (for each walker).
+
+        Return:
+            int, number of accepted proposals.
+        '''
+        cgen=self.cgen
+        if self.use_sweep and self.sampling_method=='metropolis' and not hasattr(cgen,'nwalkers'):
+            return cgen.sweep(nstep)
+        n_accepted=0
+        for i in xrange(nstep):
+            flips,pratio=cgen.fire()
+            mask=self.accept(pratio)
+            if hasattr(cgen,'nwalkers'):
+                cgen.confirm(flips,mask); n_accepted+=mask.sum()
+            elif mask:
+                cgen.confirm(flips); n_accepted+=1
+            else:
+                cgen.reject(flips)
+        return n_accepted
+
+    def autotune(self,nblock=10,block_size=20):
+        '''
+        Warm up until equilibration, and decide the measurement stride from the autocorrelation time.
+
+        The trace of log(|Psi|^2) (averaged over walkers) is recorded after each sweep of `nin` proposals, it is cheap to track,
+        so local operators are not evaluated here. The chain is equilibrated when the means of the last two quarters of
+        the trace agree within 3 sigma, if `nbath` is a number, the warm-up is just `nbath` proposals without this test.
+        Then `nblock*block_size` sweeps are binned to get the autocorrelation time.
+
+        Parameters:
+            :nblock,block_size: int, the binning of the trace used in autocorrelation analysis.
+
+        Return:
+            tuple, (number of warm-up proposals performed, measurement stride in proposals).
+        '''
+        cgen=self.cgen
+        nsweep=cgen.state.nin
+        trace=[]
+        self.status='WARM_UP'
+        nbath=0
+        if self.nbath!='auto':
+            self.advance(self.nbath); nbath=self.nbath
+        while nbath<self.nsample and self.nbath=='auto':
+            self.advance(nsweep); nbath+=nsweep
+            trace.append(mean(cgen.get_lnpsi()).real*2)
+            n=len(trace)
+            if n>=20 and n%4==0:
+                x1,x2=trace[n/2:3*n/4],trace[3*n/4:]
+                if abs(mean(x1)-mean(x2))<=3*sqrt((var(x1)+var(x2))/(n/4)):
+                    break
+
+        #binning analysis of the equilibrated trace.
+        b=Bin()
+        for i in xrange(nblock):
+            block=[]
+            for j in xrange(block_size):
+                self.advance(nsweep)
+                block.append(mean(cgen.get_lnpsi()).real*2)
+            b.push(block)
+        t_auto=b.t_auto()
+        t_auto=0.5 if isnan(t_auto) else t_auto
+        nmeasure=int(max(1,ceil(2*t_auto)))*nsweep
+        self.status='MEASURE'
+        if self.iprint>0: print 'Auto tune: nbath = %s, autocorrelation time = %.2f sweeps, nmeasure = %s.'%(nbath,t_auto,nmeasure)
+        return nbath+nblock*block_size*nsweep,nmeasure
+
     def measure(self,op,state,tol=0):
         '''
         Measure an operator.
@@ -47,20 +191,150 @@ class VMC(object):
         Parameters:
             :op: <LinOp>, a linear operator instance.
             :state: <RBM>/..., a state ansaz
-            :tol: float, tolerence.
+            :tol: float/list, target standard error (or one for each operator in queue), sampling stops once it is met, 0 to disable.
 
         Return:
             number,
         '''
-        nmeasure,nstat=self.nmeasure,int(ceil(1.*self.nsample/self.nbin))
-        bins=[Bin() for i in xrange(op.nop if isinstance(op,OpQueue) else 1)]
+        bins=self.measure_bins(op,state,tol=tol)
+        if isinstance(op,OpQueue):
+            return [b.mean() for b in bins]
+        else:
+            return bins[0].mean()
+
+    def _new_bins(self,op):
+        '''Create bins for an operator, an <OpQueue> may specify the bin type of each operator by `bin_types`.'''
+        if isinstance(op,OpQueue):
+            return [(bt or self.bin_type)() for bt in (op.bin_types or [None]*op.nop)]
+        return [self.bin_type()]
+
+    def measure_bins(self,op,state,tol=0):
+        '''
+        Measure an operator and keep the binning statistics.
+
+        Parameters:
+            :op: <LinOp>, a linear operator instance.
+            :state: <RBM>/..., a state ansaz
+            :tol: float/list, target standard error, see `VMC.measure`.
+
+        Return:
+            list, <Bin> instances, one for each operator in queue.
+        '''
+        cgen=self.cgen
+        nsample,reused=self.nsample,None
+        if self.reuse_ess is not None:
+            reused=self._get_reused(op,state)
+        if reused is not None:
+            rconfigs,w,ess=reused
+            nsample=int(nsample*(1-ess/len(rconfigs)))
+            #reused samples are already equilibrated, the fresh chain starts from ones drawn by their weights, i.e. from |psi_new|^2.
+            nwalkers=getattr(cgen,'nwalkers',None)
+            istart=random.choice(len(w),size=1 if nwalkers is None else nwalkers,p=w)
+            cgen.config=rconfigs[istart[0]].copy() if nwalkers is None else rconfigs[istart]
+        cgen.set_state(state)
+        nbath,nmeasure=self.nbath,self.nmeasure
+        if reused is not None: nbath=0
+        if nbath=='auto' or nmeasure=='auto':
+            if self.tuned is None or self._ntuned>=self.nretune:
+                self.tuned=self.autotune()
+                self._ntuned=0
+                #the chain is already equilibrated.
+                nbath=0
+            self._ntuned+=1
+            if nbath=='auto': nbath=self.tuned[0]
+            if nmeasure=='auto': nmeasure=self.tuned[1]
+        self._configs=[] if (self.keep_configs or self.reuse_ess is not None) else None
+        if nsample<=0:
+            bins=self._new_bins(op)
+        elif hasattr(cgen,'nwalkers'):
+            bins=self._measure_batch(op,tol=tol,nbath=nbath,nmeasure=nmeasure,nsample=nsample)
+        elif self.use_sweep and self.sampling_method=='metropolis':
+            bins=self._measure_sweep(op,tol=tol,nbath=nbath,nmeasure=nmeasure,nsample=nsample)
+        else:
+            bins=self._measure_single(op,tol=tol,nbath=nbath,nmeasure=nmeasure,nsample=nsample)
+        if reused is not None:
+            if self.iprint>0: print 'Reuse %s samples (%.1f effective), %s fresh proposals.'%(len(rconfigs),ess,nsample)
+            ol=self.local_values(op,state,rconfigs)
+            #weighted blocks in sampling order, counted as ess samples in total.
+            nstat=max(1,int(ceil(1.*len(ol)/self.nbin)))
+            for i in xrange(0,len(ol),nstat):
+                wi=w[i:i+nstat]*ess
+                if wi.sum()==0: continue
+                if isinstance(op,OpQueue):
+                    for k,olk in enumerate(zip(*ol[i:i+nstat])):
+                        bins[k].push(olk,weights=wi)
+                else:
+                    bins[0].push(ol[i:i+nstat],weights=wi)
+        if self._configs is not None:
+            nin=cgen.config.shape[-1]
+            configs=concatenate([reshape(c,(-1,nin)) for c in self._configs]+[zeros((0,nin),dtype='int32')]).astype('int32')
+            if self.keep_configs: self.configs=configs
+            if self.reuse_ess is not None and reused is None: self._buffers[id(op),id(state)]=[configs,state.get_lnweight(configs),0]
+        self._configs=None
+        return bins
+
+    def _get_reused(self,op,state):
+        '''
+        Reweight the buffered samples of the last full measurement of (op, state) to the new state.
+
+        Return:
+            tuple/None, (configs, w, ess), None if the buffer can not be reused.
+        '''
+        buf=self._buffers.get((id(op),id(state)))
+        if buf is None or buf[2]>=self.max_reuse:
+            self._nreuse=0
+            return None
+        configs,lnpsi=buf[0],buf[1]
+        w,ess=importance_weights(state.get_lnweight(configs),lnpsi)
+        if self.iprint>0: print 'Effective sample size of reweighted samples: %.1f/%s'%(ess,len(configs))
+        if ess<self.reuse_ess*len(configs):
+            self._nreuse=0
+            return None
+        buf[2]+=1
+        self._nreuse=buf[2]
+        return configs,w,ess
+
+    def local_values(self,op,state,configs):
+        '''
+        Evaluate local values of an operator on given configurations, without sampling.
+
+        Parameters:
+            :op: <LinOp>, a linear operator instance.
+            :state: <RBM>/..., a state ansaz.
+            :configs: 2darray, one config in a row.
+
+        Return:
+            list, local values.
+        '''
+        #evaluate once for each distinct configuration.
+        if len(configs)==0: return []
+        uconfigs,inds=unique(asarray(configs),axis=0,return_inverse=True)
+        ol=[]
+        #one generator is set up, then it jumps between configs, theta is computed for a chunk of configs at once.
+        cgen=RBMConfigGenerator(nflip=self.cgen.nflip,initial_config=uconfigs[0],diag_op=getattr(self.cgen,'diag_op',None))
+        cgen.set_state(state)
+        nchunk=4096
+        for i in xrange(0,len(uconfigs),nchunk):
+            thetas=state.feed_input(uconfigs[i:i+nchunk])
+            for config,theta in zip(uconfigs[i:i+nchunk],thetas):
+                cgen.load_config(config,theta)
+                ol.append(c_sandwich(op,cgen=cgen))
+        return [ol[i] for i in inds]
+
+    def _measure_single(self,op,tol,nbath,nmeasure,nsample):
+        '''
+        Measure an operator by a single Markov chain.
+        '''
+        nstat=int(ceil(1.*nsample/self.nbin))
+        bins=self._new_bins(op)
         ol=[]  #local operator values
         o=None
-        self.cgen.set_state(state)
         n_accepted=0
         nprint=10
 
-        for i in xrange(self.nbath+self.nsample):
+        self.status='WARM_UP'
+        for i in xrange(nbath+nsample):
+            if i==nbath: self.status='MEASURE'
             #generate new config
             flips,pratio=self.cgen.fire()
             if self.accept(pratio):
@@ -68,29 +342,298 @@ class VMC(object):
                 o=None
             else:
                 self.cgen.reject(flips)
-            if i>=self.nbath:
+            if i>=nbath:
                 if i%nmeasure==0:
                     o=c_sandwich(op,cgen=self.cgen) if o is None else o
                     ol.append(o)
-            isample=i-self.nbath
+                    if self._configs is not None: self._configs.append(self.cgen.config.copy())
+            isample=i-nbath
             if isample%nstat==nstat-1:
                 do_print=(isample/nstat)%nprint==nprint-1
                 if do_print: print '%-10s Accept rate: %.3f'%(i+1,n_accepted*1./nstat)
                 n_accepted=0
                 if len(ol)>0:
                     if isinstance(op,OpQueue):
-                        for i,oli in enumerate(zip(*ol)):
-                            bins[i].push(oli)
-                            if do_print: bins[i].print_stat()
+                        for k,olk in enumerate(zip(*ol)):
+                            bins[k].push(olk)
+                            if do_print: bins[k].print_stat()
                     else:
                         bins[0].push(ol)
                         if do_print: bins[0].print_stat()
+                    ol=[]  #local operator values
 
                     #accurate results obtained.
-                    if len(bins)>100 and all(std_bin<tol):
-                        break
-                    ol=[]  #local operator values
+                    if self.converged(bins,tol): break
+        return bins
 
+    def _measure_sweep(self,op,tol,nbath,nmeasure,nsample):
+        '''
+        Measure an operator, the `nmeasure` proposals between two measurements are performed in a single compiled sweep.
+        '''
+        cgen=self.cgen
+        nstat=max(1,int(ceil(1.*nsample/self.nbin/nmeasure)))  #number of measurements in a bin.
+        bins=self._new_bins(op)
+        ol=[]  #local operator values
+        o=None
+        nprint=10
+
+        #heat bath
+        self.status='WARM_UP'
+        cgen.sweep(nbath)
+        self.status='MEASURE'
+        n_accepted=0
+        for i in xrange(nsample/nmeasure):
+            n=cgen.sweep(nmeasure); n_accepted+=n
+            o=c_sandwich(op,cgen=cgen) if (o is None or n>0) else o
+            ol.append(o)
+            if self._configs is not None: self._configs.append(cgen.config.copy())
+            if i%nstat==nstat-1:
+                do_print=(i/nstat)%nprint==nprint-1
+                if do_print: print '%-10s Accept rate: %.3f'%(nbath+(i+1)*nmeasure,n_accepted*1./nstat/nmeasure)
+                n_accepted=0
+                if isinstance(op,OpQueue):
+                    for k,olk in enumerate(zip(*ol)):
+                        bins[k].push(olk)
+                        if do_print: bins[k].print_stat()
+                else:
+                    bins[0].push(ol)
+                    if do_print: bins[0].print_stat()
+                ol=[]
+                if self.converged(bins,tol): break
+        return bins
+
+    def _measure_batch(self,op,tol,nbath,nmeasure,nsample):
+        '''
+        Measure an operator by advancing a batch of walkers in lockstep, `nsample` is the total number of samples of all walkers.
+        '''
+        cgen=self.cgen
+        nwalkers=cgen.nwalkers
+        nstep=int(ceil(1.*nsample/nwalkers))
+        nstat=int(ceil(1.*nstep/self.nbin))
+        bins=self._new_bins(op)
+        ol=[[] for iw in xrange(nwalkers)]  #local operator values of each walker
+        o=[None]*nwalkers
+        n_accepted=0
+        nprint=10
+
+        self.status='WARM_UP'
+        for i in xrange(nbath+nstep):
+            if i==nbath: self.status='MEASURE'
+            #generate new configs for all walkers
+            flips,pratio=cgen.fire()
+            mask=self.accept(pratio)
+            cgen.confirm(flips,mask); n_accepted+=mask.sum()
+            for iw in where(mask)[0]:
+                o[iw]=None
+            if i>=nbath:
+                if i%nmeasure==0:
+                    for iw in xrange(nwalkers):
+                        o[iw]=c_sandwich(op,cgen=cgen.walker(iw)) if o[iw] is None else o[iw]
+                        ol[iw].append(o[iw])
+                    if self._configs is not None: self._configs.append(cgen.config.copy())
+            isample=i-nbath
+            if isample%nstat==nstat-1:
+                do_print=(isample/nstat)%nprint==nprint-1
+                if do_print: print '%-10s Accept rate: %.3f'%(i+1,n_accepted*1./nstat/nwalkers)
+                n_accepted=0
+                if len(ol[0])>0:
+                    #each walker contributes its own block.
+                    for oli in ol:
+                        if isinstance(op,OpQueue):
+                            for k,olik in enumerate(zip(*oli)):
+                                bins[k].push(olik)
+                        else:
+                            bins[0].push(oli)
+                    if do_print:
+                        for b in bins: b.print_stat()
+                    ol=[[] for iw in xrange(nwalkers)]
+                    if self.converged(bins,tol): break
+        return bins
+
+class ExactSampler(VMC):
+    '''
+    Draw independent samples from |psi|^2 by an alias table over the full basis, for small systems (nin up to ~24).
+
+    Amplitudes of all basis states are evaluated in vectorized chunks, there is neither warm-up nor autocorrelation.
+    The state needs @get_lnweight.
+
+    Attributes:
+        :cgen: <RBMConfigGenerator>, used to evaluate local values of operators.
+        :nsample: int, number of samples, it is the upper cap if sampling stops early on `tol`.
+        :sz0: bool, restrict to the Sz=0 sector (e.g. for Heisenberg models).
+        :nchunk: int, number of basis states evaluated in a chunk.
+    '''
+    def __init__(self,cgen,nsample,nbin=50,sz0=False,nchunk=4096,iprint=1,nbin_min=10,bin_type=Bin,keep_configs=False):
+        super(ExactSampler,self).__init__(cgen,nbath=0,nsample=nsample,nmeasure=1,nbin=nbin,iprint=iprint,nbin_min=nbin_min,bin_type=bin_type,keep_configs=keep_configs)
+        self.sz0=sz0
+        self.nchunk=nchunk
+        self._basis=None
+
+    def get_basis(self,nin):
+        '''Indices of basis states, see `utils.get_basis`.'''
+        key=(nin,self.sz0,self.nchunk)
+        if self._basis is None or self._basis[0]!=key:
+            self._basis=(key,get_basis(nin,sz0=self.sz0,nchunk=self.nchunk))
+        return self._basis[1]
+
+    def get_alias_table(self,state):
+        '''
+        Alias table of |psi|^2 over the basis.
+
+        Return:
+            tuple, (prob, alias).
+        '''
+        basis=self.get_basis(state.nin)
+        lnpsi=concatenate([state.get_lnweight(ind2config(basis[i:i+self.nchunk],state.nin)).real for i in xrange(0,len(basis),self.nchunk)])
+        return futils.falias_table(exp(2*(lnpsi-lnpsi.max())))
+
+    def measure_bins(self,op,state,tol=0):
+        self.cgen.set_state(state)
+        basis=self.get_basis(state.nin)
+        prob,alias=self.get_alias_table(state)
+        nstat=int(ceil(1.*self.nsample/self.nbin))
+        bins=self._new_bins(op)
+        configs=[]
+        #local values are evaluated once for each drawn basis state, slots[k] is the position of state k in `lvals`.
+        slots=-ones(len(basis),dtype='int64')
+        lvals=[]
+        self.status='MEASURE'
+        for i in xrange(0,self.nsample,nstat):
+            u=random.random(min(nstat,self.nsample-i))*len(basis)
+            k=u.astype('int64')
+            k=where(u-k<prob[k],k,alias[k])
+            knew=unique(k[slots[k]<0])
+            slots[knew]=arange(len(lvals),len(lvals)+len(knew))
+            lvals.extend(self.local_values(op,state,ind2config(basis[knew],state.nin)))
+            ol=[lvals[j] for j in slots[k]]
+            if isinstance(op,OpQueue):
+                for j,olj in enumerate(zip(*ol)):
+                    bins[j].push(olj)
+            else:
+                bins[0].push(ol)
+            if self.keep_configs: configs.append(ind2config(basis[k],state.nin))
+            if self.converged(bins,tol): break
+        if self.keep_configs: self.configs=concatenate(configs)
+        if self.iprint>0:
+            for b in bins: b.print_stat()
+        return bins
+
+_worker_env={}  #environment of pool workers, inherited through fork.
+
+def _worker_measure(args):
+    '''Measure on a pool worker, the state parameters are read from shared memory.'''
+    seed,tol,key=args
+    random.seed(seed)
+    env=_worker_env
+    return env['vmc'].measure_bins(env['ops'][key],env['state'],tol=tol)
+
+class ParallelVMC(object):
+    '''
+    Run independent VMC chains on a persistent process pool, and merge their binning statistics.
+
+    The pool is forked on the first measurement of an operator, so that operators (which may hold lambdas) need not be pickled,
+    operators known by workers are registered by id, later measurements of them on the same state only broadcast the RBM
+    parameters through shared memory.
+
+    It can be used as a context manager, the pool is terminated on exit.
+
+    Attributes:
+        :vmc: <VMC>, the template engine, `nsample` is divided among chains.
+        :nworker: int, number of processes.
+    '''
+    def __init__(self,vmc,nworker):
+        self.vmc=vmc
+        self.nworker=nworker
+        self._pool=None
+        self._ops={}        #id -> operators registered in workers.
+        self._state=None
+        self._params=None   #parameters of state in shared memory.
+
+    def _start(self,ops,state):
+        '''Fork a new pool for operators (a dict keyed by id) and state.'''
+        self.close()
+        arrs=[state.a,state.b,state.W]
+        dtype=result_type(*arrs)
+        buf=frombuffer(RawArray('b',dtype.itemsize*sum([x.size for x in arrs])),dtype=dtype)
+        self._params,offset=[],0
+        for x in arrs:
+            self._params.append(buf[offset:offset+x.size].reshape(x.shape))
+            offset+=x.size
+
+        #workers share parameters with this process.
+        wstate=copy.copy(state)
+        wstate.a,wstate.b,wstate.W=self._params
+        #keep the operator tracked by the generator identical to the one measured.
+        diag_op=getattr(self.vmc.cgen,'diag_op',None)
+        wvmc=copy.deepcopy(self.vmc,{} if diag_op is None else {id(diag_op):diag_op})
+        wvmc.nsample=int(ceil(1.*self.vmc.nsample/self.nworker))
+        _worker_env.update({'vmc':wvmc,'ops':ops,'state':wstate})
+        self._pool=Pool(self.nworker)
+        self._ops,self._state=ops,state
+
+    def close(self):
+        '''Terminate the pool.'''
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def measure_bins(self,op,state,tol=0):
+        '''
+        Measure an operator and keep the merged binning statistics.
+
+        Parameters:
+            :op: <LinOp>, a linear operator instance.
+            :state: <RBM>, a state ansaz
+            :tol: float/list, target standard error, see `VMC.measure`.
+
+        Return:
+            list, <Bin> instances, one for each operator in queue.
+        '''
+        if self._pool is None or state is not self._state or\
+                any([p.shape!=x.shape or p.dtype!=x.dtype for p,x in zip(self._params,[state.a,state.b,state.W])]):
+            self._start({id(op):op},state)
+        elif id(op) not in self._ops:
+            #re-fork only for an operator workers have not seen.
+            ops=dict(self._ops)
+            ops[id(op)]=op
+            self._start(ops,state)
+
+        #broadcast parameters
+        for p,x in zip(self._params,[state.a,state.b,state.W]):
+            p[...]=x
+        seeds=random.randint(0,2**31-1,self.nworker)
+        #independent chains, the merged standard error is smaller by sqrt(nworker).
+        tol=[t*sqrt(self.nworker) if t else t for t in tol] if hasattr(tol,'__iter__') else tol*sqrt(self.nworker)
+        results=self._pool.map(_worker_measure,[(seed,tol,id(op)) for seed in seeds],chunksize=1)
+        bins=results[0]
+        for res in results[1:]:
+            for b,bi in zip(bins,res):
+                b.merge(bi)
+        return bins
+
+    def measure(self,op,state,tol=0):
+        '''
+        Measure an operator.
+
+        Parameters:
+            :op: <LinOp>, a linear operator instance.
+            :state: <RBM>, a state ansaz
+            :tol: float/list, target standard error, see `VMC.measure`.
+
+        Return:
+            number,
+        '''
+        bins=self.measure_bins(op,state,tol=tol)
         if isinstance(op,OpQueue):
             return [b.mean() for b in bins]
         else: